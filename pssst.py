@@ -18,20 +18,57 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 import binascii
 import base64
+import bisect
+import cProfile
 import io
 import json
 import os
+import pstats
+import random
 import re
+import shlex
+import struct
 import sys
+import threading
 import time
 
+from collections import deque
+from contextlib import contextmanager
 from getpass import getpass
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+from tempfile import mkstemp
 from zipfile import ZipFile
 
 
 try:
-    from requests import request
+    import fcntl
+except ImportError:
+    fcntl = None # Optional (POSIX only)
+
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None # Optional
+
+
+try:
+    import orjson as fastjson
+except ImportError:
+    try:
+        import ujson as fastjson
+    except ImportError:
+        fastjson = None # Optional
+
+
+try:
+    from requests import Session
+    from requests.adapters import HTTPAdapter
     from requests.exceptions import ConnectionError, Timeout
+    from requests.packages.urllib3.exceptions import (
+        ProtocolError, ReadTimeoutError
+    )
 except ImportError:
     sys.exit("Requires Requests")
 
@@ -43,12 +80,14 @@ try:
     from Crypto.Protocol.KDF import scrypt
     from Crypto.PublicKey import RSA
     from Crypto.Signature import PKCS1_v1_5
-    from Crypto.Util.py3compat import bchr, bord, tobytes
+    from Crypto.Util.py3compat import bchr, tobytes
 except ImportError:
     sys.exit("Requires PyCrypto")
 
 
-__all__, __version__ = ["Pssst", "CLI"], "2.14.0"
+__all__, __version__ = [
+    "Pssst", "PssstPool", "PssstProfiler", "CLI"
+], "2.14.0"
 
 
 def _hexlify(data): # Utility shortcut
@@ -60,7 +99,76 @@ def _encode(data): # Utility shortcut
 
 
 def _decode(data): # Utility shortcut
-    return base64.b64decode(data.encode("utf-8"))
+    return base64.b64decode(data)
+
+
+def _encoded(data): # Utility shortcut
+    return data.encode("utf-8") if isinstance(data, type(u"")) else data
+
+
+def _dumps(data): # Utility shortcut
+    return _encoded(json.dumps(data, separators=(",", ":")))
+
+
+def _loads(data): # Utility shortcut
+    if fastjson:
+        try:
+            return fastjson.loads(bytes(data))
+        except ValueError:
+            pass # Not supported (e.g. integers beyond 64 bit)
+
+    return json.loads(data.decode("utf-8"))
+
+
+def _envelope(nonce, data, session=None, key=None): # Utility shortcut
+    return b"".join([
+        b'{"nonce":"', base64.b64encode(nonce),
+        b'","data":"', base64.b64encode(data),
+        b'","session":"' + session.encode("ascii") if session else b"",
+        b'","key":"' + base64.b64encode(key) if key else b"", b'"}'
+    ])
+
+
+def _seal(key, iv, data): # Utility shortcut
+    if isinstance(data, type(u"")):
+        data = tobytes(data)
+
+    size = AES.block_size - (len(data) % AES.block_size)
+
+    # Pad and encrypt in place
+    buffer = bytearray(len(data) + size)
+    buffer[:len(data)] = data
+    buffer[len(data):] = bchr(size) * size
+
+    AES.new(key, AES.MODE_CBC, iv).encrypt(buffer, output=buffer)
+
+    return buffer
+
+
+def _open(key, iv, data): # Utility shortcut
+    buffer = bytearray(len(data))
+
+    # Decrypt and unpad in place
+    AES.new(key, AES.MODE_CBC, iv).decrypt(data, output=buffer)
+
+    del buffer[len(buffer) - buffer[-1]:]
+
+    return buffer
+
+
+def _percentiles(samples): # Utility shortcut
+    samples = sorted(samples)
+
+    def percentile(p):
+        return samples[int(p * (len(samples) - 1))] if samples else None
+
+    return {
+        "requests": len(samples),
+        "p50": percentile(0.50),
+        "p90": percentile(0.90),
+        "p99": percentile(0.99),
+        "max": samples[-1] if samples else None
+    }
 
 
 class Pssst:
@@ -77,10 +185,24 @@ class Pssst:
         Returns the public key of an user.
     pull()
         Pulls all messages from the box.
-    push(user, data)
+    push(user, data, session)
         Pushes a message into the box.
+    prefetch(users)
+        Fetches the public keys of many users concurrently.
+    fetch()
+        Pulls all messages from the box into the inbox.
+    inbox(cursor, limit, since)
+        Returns a page of messages from the inbox.
+    discard(ids)
+        Removes messages from the inbox.
+    stats()
+        Returns the request latency statistics.
 
     """
+    TIMEOUT, CONNECT, RETRIES, BACKOFF = 30.0, 3.05, 2, 0.1
+
+    CHUNK = 64 * 1024
+
     class _User:
         """
         Internal parser class for canonical user names.
@@ -90,7 +212,7 @@ class Pssst:
         This class is not meant to be called externally.
 
         """
-        def __init__(self, username, password=None, server=None):
+        def __init__(self, username, password=None, server=None, cache=None):
             """
             Initializes the instance with the parsed user name.
 
@@ -102,6 +224,8 @@ class Pssst:
                 User private key password.
             param server : string, optional (default is None)
                 Server address.
+            param cache : dict, optional (default is None)
+                User hash cache.
 
             """
             username = username.strip()
@@ -119,9 +243,16 @@ class Pssst:
                 username, password = username.split(":", 1)
 
             self.name = username.lower()
-            self.hash = _hexlify(scrypt(repr(self), b"[Pssst!]", 32, 16384, 8, 1, 1))
             self.profile = (self.name, password, server)
 
+            if cache is not None and self.name in cache:
+                self.hash = cache[self.name]
+            else:
+                self.hash = _hexlify(scrypt(repr(self), b"[Pssst!]", 32, 16384, 8, 1, 1))
+
+            if cache is not None:
+                cache[self.name] = self.hash
+
         def __repr__(self):
             """
             Returns the full user name in canonical notation.
@@ -141,9 +272,13 @@ class Pssst:
         public()
             Returns the users public key (PEM format).
         encrypt(data)
-            Returns the encrypted data and nonce.
+            Returns the encrypted data (in a new buffer) and nonce.
         decrypt(data, nonce)
-            Returns the decrypted data.
+            Returns the decrypted data (in a new buffer).
+        wrap(secret)
+            Returns the encrypted secret.
+        unwrap(secret)
+            Returns the decrypted secret.
         sign(data)
             Returns the data timestamp and signature.
         verify(data, timestamp, signature)
@@ -177,22 +312,24 @@ class Pssst:
 
         def encrypt(self, data):
             nonce = Random.get_random_bytes(Pssst._Key.NONCE_SIZE)
-            size = AES.block_size - (len(data) % AES.block_size)
-            data = tobytes(data) + (bchr(size) * size)
-
-            data = AES.new(nonce[:32], AES.MODE_CBC, nonce[32:]).encrypt(data)
-            nonce = PKCS1_OAEP.new(self.key).encrypt(nonce)
+            data = _seal(nonce[:32], nonce[32:], data)
+            nonce = self.wrap(nonce)
 
             return (data, nonce)
 
         def decrypt(self, data, nonce):
-            nonce = PKCS1_OAEP.new(self.key).decrypt(nonce)
-            data = AES.new(nonce[:32], AES.MODE_CBC, nonce[32:]).decrypt(data)
+            nonce = self.unwrap(nonce)
+
+            return _open(nonce[:32], nonce[32:], data)
 
-            return data[:-bord(data[-1])]
+        def wrap(self, secret):
+            return PKCS1_OAEP.new(self.key).encrypt(secret)
+
+        def unwrap(self, secret):
+            return PKCS1_OAEP.new(self.key).decrypt(secret)
 
         def sign(self, data):
-            current, data = self.__epoch(), data.encode("utf-8")
+            current, data = self.__epoch(), _encoded(data)
 
             hmac = HMAC.new(str(current).encode("ascii"), data, SHA256)
             hmac = SHA256.new(hmac.digest())
@@ -202,7 +339,7 @@ class Pssst:
             return (current, signature)
 
         def verify(self, data, timestamp, signature):
-            current, data = self.__epoch(), data.encode("utf-8")
+            current, data = self.__epoch(), _encoded(data)
 
             hmac = HMAC.new(str(timestamp).encode("ascii"), data, SHA256)
             hmac = SHA256.new(hmac.digest())
@@ -211,6 +348,101 @@ class Pssst:
                 return PKCS1_v1_5.new(self.key).verify(hmac, signature)
 
 
+    class _Ring:
+        """
+        Internal consistent hash ring for sharded servers.
+
+        Methods
+        -------
+        server(hash)
+            Returns the server of an user hash.
+
+        Notes
+        -----
+        This class is not meant to be called externally. Every server is
+        placed REPLICAS times on the ring, so adding or removing a server
+        only moves the users of its own segments.
+
+        """
+        REPLICAS = 64
+
+        def __init__(self, servers):
+            if isinstance(servers, (str, type(u""))):
+                servers = servers.split(",")
+
+            self.servers = sorted(set(
+                server.strip().rstrip("/") for server in servers if server.strip()
+            ))
+
+            if not self.servers:
+                raise Exception("Server required")
+
+            self.ring = sorted((self.__point(
+                "%s#%s" % (server, replica)
+            ), server) for server in self.servers for replica in range(
+                Pssst._Ring.REPLICAS
+            ))
+            self.points = [point for point, _ in self.ring]
+
+        def __len__(self):
+            return len(self.servers)
+
+        def __point(self, value):
+            return int(SHA256.new(value.encode("utf-8")).hexdigest()[:16], 16)
+
+        def server(self, hash):
+            if len(self.servers) == 1:
+                return self.servers[0]
+
+            index = bisect.bisect(self.points, int(hash[:16], 16))
+
+            return self.ring[index % len(self.ring)][1]
+
+
+    class _Session:
+        """
+        Internal session class for amortized symmetric encryption.
+
+        Methods
+        -------
+        expired()
+            Returns if the session must be rotated.
+        encrypt(data)
+            Returns the encrypted data (in a new buffer) and IV.
+        decrypt(data, iv)
+            Returns the decrypted data (in a new buffer).
+
+        Notes
+        -----
+        This class is not meant to be called externally. The session key is
+        wrapped once with the receivers public key and only sent along until
+        the first message was pushed successfully.
+
+        """
+        MESSAGES, LIFETIME = 1000, 3600
+
+        def __init__(self, secret, wrapped, id=None):
+            self.id = id or _hexlify(Random.get_random_bytes(8))
+            self.secret = secret
+            self.wrapped = wrapped
+            self.confirmed = False
+            self.created = time.time()
+            self.count = 0
+
+        def expired(self):
+            return self.count >= Pssst._Session.MESSAGES or (
+                time.time() - self.created >= Pssst._Session.LIFETIME
+            )
+
+        def encrypt(self, data):
+            iv = Random.get_random_bytes(AES.block_size)
+
+            return (_seal(self.secret, iv, data), iv)
+
+        def decrypt(self, data, iv):
+            return _open(self.secret, iv, data)
+
+
     class _KeyStorage:
         """
         Internal storage class for public and private keys.
@@ -219,37 +451,46 @@ class Pssst:
         -------
         delete()
             Deletes the users key storage.
-        server()
-            Saves the public server key.
+        server(api, key)
+            Returns (and saves) the public key of a server.
         list()
             Returns an alphabetical list of all key entries.
         load(entry)
             Returns a key.
         save(entry, key)
             Saves a key.
+        update(keys)
+            Saves many keys at once.
 
         Notes
         -----
-        This class is not meant to be called externally.
+        This class is not meant to be called externally. All entries are
+        read from a cached index, which is reloaded only if the file was
+        changed. Writes are serialized by a lock per instance and a file lock
+        (POSIX only) shared by all processes. Existing entries are kept.
 
         """
         def __init__(self, api, user, password):
             self.scheme = "%s"
             self.user = user
             self.file = os.path.join(os.path.expanduser("~"), repr(self))
+            self.lock = threading.RLock()
+            self.locks = 0
+            self.entries = {}
+            self.version = None
+
+            with self.__locked():
+                if os.path.exists(self.file):
+                    self.key = Pssst._Key(self.load("id_rsa"), password)
+                else:
+                    self.key = Pssst._Key()
+                    self.save("id_rsa", self.key.private(password))
 
-            if os.path.exists(self.file):
-                self.key = Pssst._Key(self.load("id_rsa"), password)
-            else:
-                self.key = Pssst._Key()
-                self.save("id_rsa", self.key.private(password))
-
-            self.scheme = re.sub("^(?i)https?://(.+)", "\g<1>/%s.pub", api)
+            self.scheme = self.__scheme(api)
+            self.apis = {}
 
-            if "id_rsa" in self.list():
-                self.api = Pssst._Key(self.load("id_rsa"))
-            else:
-                self.api = None
+        def __scheme(self, api):
+            return re.sub("^https?://(.+)", "\g<1>/%s.pub", api, flags=re.I)
 
         def __repr__(self):
             return ".pssst." + self.user
@@ -260,34 +501,239 @@ class Pssst:
         def __nonzero__(self):
             return os.path.exists(self.file)
 
+        @contextmanager
+        def __locked(self):
+            with self.lock:
+                if not fcntl or self.locks:
+                    self.locks += 1
+
+                    try:
+                        yield
+                    finally:
+                        self.locks -= 1
+
+                    return
+
+                with open(self.file + ".lock", "a") as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    self.locks += 1
+
+                    try:
+                        yield
+                    finally:
+                        self.locks -= 1
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+        def __stat(self):
+            try:
+                stat = os.stat(self.file)
+            except OSError:
+                return None
+
+            return (stat.st_mtime, stat.st_size)
+
+        def __index(self):
+            if self.__stat() != self.version:
+                with self.__locked():
+                    version, entries = self.__stat(), {}
+
+                    if version:
+                        with ZipFile(self.file, "r") as file:
+                            for name in file.namelist():
+                                entries[name] = file.read(name)
+
+                    self.entries, self.version = entries, version
+
+            return self.entries
+
+        def __write(self, entries):
+            with self.__locked():
+                index = dict(self.__index())
+                entries = dict(
+                    (name, data) for name, data in entries.items()
+                    if name not in index
+                )
+
+                if entries:
+                    with ZipFile(self.file, "a") as file:
+                        for name, data in entries.items():
+                            file.writestr(name, data)
+
+                    index.update((name, _encoded(data))
+                                 for name, data in entries.items())
+
+                    self.entries, self.version = index, self.__stat()
+
         def delete(self):
-            os.remove(self.file)
+            with self.__locked():
+                os.remove(self.file)
 
-        def server(self, key):
-            self.save("id_rsa", key)
-            self.api = Pssst._Key(self.load("id_rsa"))
+                self.entries, self.version = {}, None
+
+            if os.path.exists(self.file + ".lock"):
+                os.remove(self.file + ".lock")
+
+        def server(self, api, key=None):
+            entry = self.__scheme(api) % "id_rsa"
+
+            if key:
+                self.__write({entry: key})
+
+                self.apis[api] = Pssst._Key(self.__index()[entry])
+
+            elif api not in self.apis:
+                try:
+                    self.apis[api] = Pssst._Key(self.__index()[entry])
+                except KeyError:
+                    return None
+
+            return self.apis[api]
 
         def list(self):
-            with ZipFile(self.file, "r") as file:
-                keys = []
+            keys = []
 
-                # Filter out APIs
-                for key in file.namelist():
-                    if key.startswith(self.scheme.rsplit("/")[0]):
-                        keys.append(re.sub("^.+/(.+)\.pub$", "\g<1>", key))
+            # Filter out APIs and sessions
+            for key in self.__index():
+                if key.startswith(self.scheme.rsplit("/")[0]):
+                    key = re.match("^.+/(\w+)\.pub$", key)
 
-                return keys
+                    if key:
+                        keys.append(key.group(1))
+
+            return sorted(keys)
 
         def load(self, entry):
-            with ZipFile(self.file, "r") as file:
-                return file.read(self.scheme % entry)
+            return self.__index()[self.scheme % entry]
 
         def save(self, entry, key):
-            with ZipFile(self.file, "a") as file:
-                file.writestr(self.scheme % entry, key)
+            self.__write({self.scheme % entry: key})
+
+        def update(self, keys):
+            self.__write(dict(
+                (self.scheme % entry, key) for entry, key in keys.items()
+            ))
+
+
+    class _InboxStorage:
+        """
+        Internal storage class for pulled messages.
+
+        Methods
+        -------
+        delete()
+            Deletes the users inbox storage.
+        append(messages)
+            Appends the messages in one transaction.
+        query(cursor, limit, since)
+            Returns a page of messages.
+        keys(sessions)
+            Returns the wrapped keys of the sessions.
+        remove(ids)
+            Removes the messages.
+
+        Notes
+        -----
+        This class is not meant to be called externally. All messages will be
+        stored encrypted, exactly as they were pulled from the box. The
+        connection is shared by all threads, so every access is serialized.
+
+        """
+        def __init__(self, user):
+            self.db = None
+            self.lock = threading.RLock()
+            self.user = user
+            self.file = os.path.join(os.path.expanduser("~"), repr(self))
+
+        def __repr__(self):
+            return ".pssst.%s.db" % self.user
 
+        def __bool__(self):
+            return self.__nonzero__()
+
+        def __nonzero__(self):
+            return os.path.exists(self.file)
+
+        def __connect(self):
+            if not sqlite3:
+                raise Exception("Requires SQLite")
+
+            if not self.db:
+                self.db = sqlite3.connect(self.file, check_same_thread=False)
+
+                with self.db:
+                    self.db.execute("""
+                        CREATE TABLE IF NOT EXISTS box (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            timestamp INTEGER NOT NULL,
+                            size INTEGER NOT NULL,
+                            session TEXT,
+                            key TEXT,
+                            nonce BLOB NOT NULL,
+                            data BLOB NOT NULL
+                        )
+                    """)
+
+                    # Inboxes created before session keys were stored
+                    if "key" not in [column[1] for column in self.db.execute(
+                        "PRAGMA table_info(box)"
+                    )]:
+                        self.db.execute("ALTER TABLE box ADD COLUMN key TEXT")
+
+                    self.db.execute("""
+                        CREATE INDEX IF NOT EXISTS box_timestamp
+                        ON box (timestamp)
+                    """)
+
+            return self.db
 
-    def __init__(self, username, password, server=None):
+        def delete(self):
+            with self.lock:
+                if self.db:
+                    self.db.close()
+                    self.db = None
+
+                os.remove(self.file)
+
+        def append(self, messages):
+            timestamp = int(round(time.time()))
+
+            with self.lock, self.__connect() as db:
+                db.executemany("""
+                    INSERT INTO box
+                    (timestamp, size, session, key, nonce, data)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, [(
+                    timestamp,
+                    len(data),
+                    session,
+                    key,
+                    sqlite3.Binary(nonce),
+                    sqlite3.Binary(data)
+                ) for nonce, data, session, key in messages])
+
+        def query(self, cursor=0, limit=100, since=0):
+            with self.lock:
+                return self.__connect().execute("""
+                    SELECT id, timestamp, session, nonce, data FROM box
+                    WHERE id > ? AND timestamp >= ? ORDER BY id LIMIT ?
+                """, (cursor, since, limit)).fetchall()
+
+        def keys(self, sessions):
+            with self.lock:
+                return self.__connect().execute("""
+                    SELECT DISTINCT session, key FROM box
+                    WHERE key IS NOT NULL AND session IN (%s)
+                """ % ",".join("?" * len(sessions)), list(sessions)).fetchall()
+
+        def remove(self, ids):
+            with self.lock, self.__connect() as db:
+                db.executemany("""
+                    DELETE FROM box WHERE id = ?
+                """, [(id,) for id in ids])
+
+
+    def __init__(self, username, password, server=None, timeout=None,
+                 pool=None):
         """
         Initializes the instance with an user object.
 
@@ -297,8 +743,12 @@ class Pssst:
             User name.
         param password : string
             User private key password.
-        param server : string, optional (default is None)
-            Server address.
+        param server : string or list, optional (default is None)
+            Server address (or addresses, if sharded).
+        param timeout : float, optional (default is None)
+            Deadline for every call in seconds.
+        param pool : PssstPool, optional (default is None)
+            Pool to share connections and caches with.
 
         Raises
         ------
@@ -312,6 +762,18 @@ class Pssst:
         If the environment variable 'PSSST' exists, it will be used as the API
         address and port. If a server is given, it will override the API.
 
+        Multiple servers can be given as list or comma separated. Then every
+        user is mapped to one of the servers by consistent hashing over the
+        user hash. All servers must be independent instances.
+
+        Every call must finish within its deadline, including all retries.
+        If no timeout is given, the class default TIMEOUT will be used.
+
+        Instances are thread-safe and can be shared by a thread pool. Several
+        processes can share one profile, because all key storage writes are
+        guarded by a file lock (POSIX only). All cipher objects are created
+        per call, so keys are never shared in an intermediate state.
+
         """
         API = "http://localhost:62221"
 
@@ -321,12 +783,19 @@ class Pssst:
         if not password:
             raise Exception("Password required")
 
-        self.api = server or os.environ.get("PSSST", API)
-        self.user = Pssst._User(username)
+        self.ring = Pssst._Ring(server or os.environ.get("PSSST", API))
+        self.timeout = timeout or Pssst.TIMEOUT
+        self.latency = deque(maxlen=1000)
+        self.pool = pool if pool is not None else PssstPool()
+        self.user = Pssst._User(username, cache=self.pool.users)
+        self.api = self.ring.server(self.user.hash)
         self.keys = Pssst._KeyStorage(self.api, self.user.name, password)
+        self.box = Pssst._InboxStorage(self.user.name)
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.secrets = {}
 
-        if not self.keys.api:
-            self.keys.server(self.__request_url("key"))
+        self.__server(self.api)
 
     def __repr__(self):
         """
@@ -340,7 +809,155 @@ class Pssst:
         """
         return "Pssst CLI"
 
-    def __request_api(self, method, path, data=None, auth=True):
+    def __server(self, api):
+        """
+        Returns the public key of a server.
+
+        Parameters
+        ----------
+        param api : string
+            Server address.
+
+        Returns
+        -------
+        _Key
+            The server key.
+
+        Notes
+        -----
+        Unknown server keys are fetched once and saved in the key storage.
+
+        """
+        key = self.keys.server(api)
+
+        if not key:
+            if api not in self.pool.servers:
+                key = self.__request_url("key", retries=Pssst.RETRIES, api=api)
+                self.pool.servers[api] = key
+
+            key = self.keys.server(api, self.pool.servers[api])
+
+        return key
+
+    def __request(self, method, url, timeout=None, retries=0, **kwargs):
+        """
+        Returns the response of a HTTP request within the deadline.
+
+        Parameters
+        ----------
+        param method : string
+            Request method.
+        param url : string
+            Request URL.
+        param timeout : float, optional (default is None)
+            Request deadline in seconds.
+        param retries : int, optional (default is 0)
+            Request retries (only for idempotent requests).
+        param kwargs : dict
+            Request arguments.
+
+        Returns
+        -------
+        Response
+            The response object.
+
+        Raises
+        ------
+        Timeout
+            Because the deadline was exceeded.
+
+        Notes
+        -----
+        Retries are delayed with an exponential backoff and full jitter. The
+        response body is streamed and the deadline is checked after every
+        chunk, so a slowly sending server can not hold a call past it.
+
+        """
+        deadline = time.time() + (timeout or self.timeout)
+
+        for retry in range(retries + 1):
+            remaining = deadline - time.time()
+
+            if remaining <= 0:
+                raise Timeout("Deadline exceeded")
+
+            try:
+                start = time.time()
+                response = self.pool.request(method, url=url, timeout=(
+                    min(Pssst.CONNECT, remaining), remaining
+                ), stream=True, **kwargs)
+
+                # Cache the body, as if it was not streamed
+                response._content = self.__content(response, deadline)
+
+                self.latency.append(time.time() - start)
+
+                return response
+
+            except (ConnectionError, Timeout):
+                if retry == retries:
+                    raise
+
+            backoff = random.uniform(0, Pssst.BACKOFF * (2 ** retry))
+            time.sleep(max(0, min(backoff, deadline - time.time())))
+
+    def __content(self, response, deadline):
+        """
+        Returns the body of a streamed response within the deadline.
+
+        Parameters
+        ----------
+        param response : Response
+            The streamed response object.
+        param deadline : float
+            Request deadline (EPOCH).
+
+        Returns
+        -------
+        byte string
+            The response body.
+
+        Raises
+        ------
+        Timeout
+            Because the deadline was exceeded.
+
+        Notes
+        -----
+        The deadline is checked after every chunk. Chunks are returned as
+        soon as any data arrived (if supported by urllib3), otherwise a
+        read may block until a full chunk arrived or the read timed out.
+
+        """
+        read = getattr(response.raw, "read1", None)
+
+        try:
+            if read:
+                chunks = iter(lambda: read(Pssst.CHUNK, True), b"")
+            else:
+                chunks = response.iter_content(Pssst.CHUNK)
+
+            body = bytearray()
+
+            for chunk in chunks:
+                if time.time() > deadline:
+                    raise Timeout("Deadline exceeded")
+
+                body += chunk
+
+            return bytes(body)
+
+        except ReadTimeoutError:
+            raise Timeout("Read timed out")
+
+        except ProtocolError as ex:
+            raise ConnectionError(ex)
+
+        finally:
+            response.close()
+
+    def __request_api(self, method, path, data=None, auth=True, timeout=None,
+                      retries=0):
         """
         Returns the result of an API request (signed and verified).
 
@@ -350,10 +967,14 @@ class Pssst:
             Request method.
         param path : string
             Request path.
-        param data : JSON, optional (default is None)
-            Request data.
+        param data : JSON or bytes, optional (default is None)
+            Request data (bytes are send as they are).
         param auth : bool
             Request authentication.
+        param timeout : float, optional (default is None)
+            Request deadline in seconds.
+        param retries : int, optional (default is 0)
+            Request retries (only for idempotent requests).
 
         Returns
         -------
@@ -373,16 +994,24 @@ class Pssst:
 
         Notes
         -----
-        Please see the __init__ method.
+        Please see the __init__ method. The request is sent to the server of
+        the user hash in the path.
 
         """
         if not self.keys:
             raise Exception("User was deleted")
 
-        url = "%s/2/%s" % (self.api, path)
-        body = str(json.dumps(data, separators=(",", ":"))) if data else ""
+        api = self.ring.server(path)
+        url = "%s/2/%s" % (api, path)
+
+        if isinstance(data, (bytes, bytearray)):
+            body = data
+        elif data:
+            body = _dumps(data)
+        else:
+            body = b""
         headers = {
-            "content-type": "application/json" if data else "text/plain",
+            "content-type": "application/json" if body else "text/plain",
             "user-agent": repr(self)
         }
 
@@ -392,11 +1021,12 @@ class Pssst:
 
             headers["x-pssst-hash"] = "%s; %s" % (timestamp, signature)
 
-        response = request(method, url=url, data=body, headers=headers)
+        response = self.__request(method, url, timeout, retries,
+                                  data=body, headers=headers)
 
         mime = response.headers.get("content-type", "text/plain")
         head = response.headers.get("x-pssst-hash")
-        body = response.text
+        body = response.content
 
         if not re.match("^[0-9]+; ?[A-Za-z0-9\+/]+=*$", head):
             raise Exception("Verification failed")
@@ -404,18 +1034,18 @@ class Pssst:
         timestamp, signature = head.split(";", 1)
         timestamp, signature = int(timestamp), _decode(signature)
 
-        if not self.keys.api.verify(body, timestamp, signature):
+        if not self.__server(api).verify(body, timestamp, signature):
             raise Exception("Verification failed")
 
         if response.status_code not in [200, 204]:
-            raise Exception(body)
+            raise Exception(body.decode("utf-8"))
 
         if mime.startswith("application/json"):
-            body = response.json()
+            return _loads(body)
 
-        return body
+        return body.decode("utf-8")
 
-    def __request_url(self, path):
+    def __request_url(self, path, timeout=None, retries=0, api=None):
         """
         Returns the result of an URL request (without any checks).
 
@@ -423,6 +1053,12 @@ class Pssst:
         ----------
         param path : string
             Requested path.
+        param timeout : float, optional (default is None)
+            Request deadline in seconds.
+        param retries : int, optional (default is 0)
+            Request retries.
+        param api : string, optional (default is None)
+            Server address (default is the users server).
 
         Returns
         -------
@@ -439,97 +1075,1055 @@ class Pssst:
         Please see the __init__ method.
 
         """
-        url = "%s/%s" % (self.api, path)
+        url = "%s/%s" % (api or self.api, path)
         headers = {
             "user-agent": repr(self)
         }
 
-        response = request("GET", url=url, headers=headers)
+        response = self.__request("GET", url, timeout, retries,
+                                  headers=headers)
 
         if response.status_code not in [200, 204]:
             raise ConnectionError("Not Found")
 
         return response.text
 
-    def create(self):
+    def __session(self, id, wrapped=None):
         """
-        Creates an user.
+        Returns the receiving session.
 
-        """
-        body = {"key": self.keys.key.public()}
+        Parameters
+        ----------
+        param id : string
+            Session id.
+        param wrapped : byte string, optional (default is None)
+            Wrapped session key.
 
-        self.__request_api("POST", self.user.hash, body)
+        Returns
+        -------
+        _Session
+            The session.
 
-    def delete(self):
-        """
-        Deletes an user.
+        Raises
+        ------
+        Exception
+            Because the session is invalid.
+        Exception
+            Because the session is unknown.
 
         Notes
         -----
-        If the user was deleted, the object can not be used any further and
-        any API call will result in an error. The key storage is also deleted.
+        Wrapped session keys are persisted in the key storage, because later
+        messages of the session may be pulled by another process. The first
+        key received for a session id, which can be unwrapped, will be kept.
 
         """
-        self.__request_api("DELETE", self.user.hash)
-        self.keys.delete()
+        if not isinstance(id, (str, type(u""))) or not re.match(
+            "^[0-9a-f]{16}$", id
+        ):
+            raise Exception("Session invalid")
 
-    def find(self, user):
-        """
-        Returns the public key of an user.
+        with self.lock:
+            if id not in self.secrets:
+                entry = "session-" + id
 
-        Parameters
-        ----------
-        param user : string
-            The user name.
+                try:
+                    wrapped, stored = self.keys.load(entry), True
+                except KeyError:
+                    if not wrapped:
+                        raise Exception("Session unknown")
 
-        Returns
-        -------
-        string
-            PEM formatted public key.
+                    stored = False
 
-        """
-        return self.__request_api("GET", Pssst._User(user).hash + "/key")
+                try:
+                    secret = self.keys.key.unwrap(wrapped)
+                except (TypeError, ValueError):
+                    raise Exception("Session invalid")
 
-    def pull(self):
-        """
-        Pulls all messages from the box.
+                if len(secret) != 32:
+                    raise Exception("Session invalid")
 
-        Returns
-        -------
-        list of byte strings
-            The message data.
+                # Persist only keys which could be unwrapped
+                if not stored:
+                    self.keys.save(entry, wrapped)
 
-        """
-        data = self.__request_api("GET", self.user.hash + "/box") or []
+                self.secrets[id] = Pssst._Session(secret, wrapped, id)
 
-        return [self.keys.key.decrypt(
-            _decode(message["data"]),
-            _decode(message["nonce"])
-        ) for message in data]
+            return self.secrets[id]
 
-    def push(self, user, data):
+    def __decrypt(self, nonce, data, session=None):
         """
-        Pushes a message into a box.
+        Returns the decrypted message data.
 
         Parameters
         ----------
-        param user : string
-            The user name.
+        param nonce : byte string
+            Message nonce (or IV of a session).
         param data : byte string
+            Message data.
+        param session : string, optional (default is None)
+            Session id.
+
+        Returns
+        -------
+        bytearray
             The message data.
 
         """
-        user = Pssst._User(user)
-
-        if user.name not in self.keys.list():
-            self.keys.save(user.name, self.find(user.name))
+        if session:
+            return self.__session(session).decrypt(data, nonce)
+        else:
+            return self.keys.key.decrypt(data, nonce)
 
-        data, nonce = Pssst._Key(self.keys.load(user.name)).encrypt(data)
+    def __register(self, keys):
+        """
+        Registers the sessions of all valid session keys.
 
-        self.__request_api("PUT", user.hash + "/box", {
-            "nonce": _encode(nonce),
-            "data": _encode(data)
-        }, False)
+        Parameters
+        ----------
+        param keys : list of tuples
+            The session ids and wrapped session keys (Base64 encoded).
+
+        Notes
+        -----
+        Anyone can push messages, so a session key which can not be
+        registered is skipped. The messages of its session will then not be
+        decrypted, but all other messages will.
+
+        """
+        for id, key in keys:
+            try:
+                self.__session(id, _decode(key))
+            except Exception:
+                continue # Forged or corrupt session key
+
+    def __receive(self, messages):
+        """
+        Returns the messages after registering their sessions.
+
+        Parameters
+        ----------
+        param messages : list of dicts
+            The pulled messages.
+
+        Returns
+        -------
+        list of dicts
+            The pulled messages.
+
+        Notes
+        -----
+        Concurrently pushed messages of a session may arrive before the one
+        carrying the session key, so all keys are registered first.
+
+        """
+        self.__register([(
+            message.get("session"),
+            message.get("key")
+        ) for message in messages if isinstance(message, dict) and (
+            message.get("session") and message.get("key")
+        )])
+
+        return messages
+
+    def __open(self, messages):
+        """
+        Returns the decrypted data of all decryptable messages.
+
+        Parameters
+        ----------
+        param messages : list of dicts
+            The pulled messages.
+
+        Returns
+        -------
+        list of bytearrays
+            The message data.
+
+        Notes
+        -----
+        Anyone can push messages, so a message which can not be decrypted
+        is skipped instead of failing all others (and blocking the box).
+
+        """
+        data = []
+
+        for message in self.__receive(messages):
+            try:
+                data.append(self.__decrypt(
+                    _decode(message["nonce"]),
+                    _decode(message["data"]),
+                    message.get("session")
+                ))
+            except Exception:
+                continue # Forged or corrupt message
+
+        return data
+
+    def create(self, timeout=None):
+        """
+        Creates an user.
+
+        Parameters
+        ----------
+        param timeout : float, optional (default is None)
+            Deadline of this call in seconds.
+
+        """
+        body = {"key": self.keys.key.public()}
+
+        self.__request_api("POST", self.user.hash, body, timeout=timeout)
+
+    def delete(self, timeout=None):
+        """
+        Deletes an user.
+
+        Parameters
+        ----------
+        param timeout : float, optional (default is None)
+            Deadline of this call in seconds.
+
+        Notes
+        -----
+        If the user was deleted, the object can not be used any further and
+        any API call will result in an error. The key storage and the inbox are
+        also deleted.
+
+        """
+        self.__request_api("DELETE", self.user.hash, timeout=timeout)
+        self.keys.delete()
+
+        if self.box:
+            self.box.delete()
+
+    def find(self, user, timeout=None):
+        """
+        Returns the public key of an user.
+
+        Parameters
+        ----------
+        param user : string
+            The user name.
+        param timeout : float, optional (default is None)
+            Deadline of this call in seconds.
+
+        Returns
+        -------
+        string
+            PEM formatted public key.
+
+        Notes
+        -----
+        This call is idempotent and will be retried on connection errors.
+
+        """
+        path = Pssst._User(user, cache=self.pool.users).hash + "/key"
+
+        return self.__request_api("GET", path, None, True, timeout,
+                                  Pssst.RETRIES)
+
+    def pull(self, timeout=None, buffer=False):
+        """
+        Pulls all messages from the box.
+
+        Parameters
+        ----------
+        param timeout : float, optional (default is None)
+            Deadline of this call in seconds.
+        param buffer : bool, optional (default is False)
+            Return the decryption buffers without copying them.
+
+        Returns
+        -------
+        list of byte strings (or bytearrays)
+            The message data.
+
+        Notes
+        -----
+        Messages which can not be decrypted are skipped.
+
+        """
+        path = self.user.hash + "/box"
+        data = self.__request_api("GET", path, timeout=timeout) or []
+        data = self.__open(data)
+
+        return data if buffer else [bytes(message) for message in data]
+
+    def pages(self, limit=100, timeout=None, buffer=False):
+        """
+        Pulls all messages from the box, page by page.
+
+        Parameters
+        ----------
+        param limit : int, optional (default is 100)
+            Maximum number of messages per page.
+        param timeout : float, optional (default is None)
+            Deadline of every page request in seconds.
+        param buffer : bool, optional (default is False)
+            Return the decryption buffers without copying them.
+
+        Returns
+        -------
+        generator of lists of byte strings (or bytearrays)
+            The message data of every page.
+
+        Raises
+        ------
+        Exception
+            Because the limit is invalid.
+
+        Notes
+        -----
+        The messages of a page are removed from the box only when the next
+        page is requested (or after the last page), so a page is never lost
+        if the client fails while processing it. If the iteration is stopped
+        early, the unacknowledged page will be pulled again the next time.
+        Messages which can not be decrypted are skipped, so they are still
+        acknowledged with their page.
+
+        """
+        if not 0 < limit <= 1000:
+            raise Exception("Limit invalid")
+
+        path = self.user.hash + "/box?limit=%d&cursor=%d"
+        cursor, more = 0, True
+
+        while more:
+            page = self.__request_api("GET", path % (limit, cursor),
+                                      timeout=timeout, retries=Pssst.RETRIES)
+            data = self.__open(page["box"])
+
+            yield data if buffer else [bytes(message) for message in data]
+
+            cursor, more = page["cursor"], page["more"]
+
+        self.__request_api("GET", path % (0, cursor), timeout=timeout,
+                           retries=Pssst.RETRIES)
+
+    def push(self, user, data, timeout=None, session=False):
+        """
+        Pushes a message into a box.
+
+        Parameters
+        ----------
+        param user : string
+            The user name.
+        param data : byte string
+            The message data.
+        param timeout : float, optional (default is None)
+            Deadline of this call in seconds.
+        param session : bool, optional (default is False)
+            Encrypt with the session key of the receiver.
+
+        Notes
+        -----
+        In session mode, the receivers public key is used only once per
+        session to wrap a symmetric key. The session is rotated after
+        _Session.MESSAGES messages or _Session.LIFETIME seconds. Receivers
+        must use a client which supports sessions.
+
+        """
+        user = Pssst._User(user, cache=self.pool.users)
+
+        if user.name not in self.pool.keys:
+            if user.name not in self.keys.list():
+                self.keys.save(user.name, self.find(user.name, timeout))
+
+            self.pool.keys[user.name] = Pssst._Key(self.keys.load(user.name))
+
+        key = self.pool.keys[user.name]
+
+        if not session:
+            data, nonce = key.encrypt(data)
+            body = _envelope(nonce, data)
+        else:
+            with self.lock:
+                current = self.sessions.get(user.name)
+
+                if not current or current.expired():
+                    secret = Random.get_random_bytes(32)
+                    current = Pssst._Session(secret, key.wrap(secret))
+
+                    self.sessions[user.name] = current
+
+                current.count += 1
+
+            data, nonce = current.encrypt(data)
+            body = _envelope(nonce, data, current.id, (
+                current.wrapped if not current.confirmed else None
+            ))
+
+        self.__request_api("PUT", user.hash + "/box", body, False, timeout)
+
+        if session:
+            current.confirmed = True
+
+    def prefetch(self, users, timeout=None):
+        """
+        Fetches the public keys of many users concurrently.
+
+        Parameters
+        ----------
+        param users : list of strings
+            The user names.
+        param timeout : float, optional (default is None)
+            Deadline of every key request in seconds.
+
+        Returns
+        -------
+        dict
+            The error messages of all users which could not be fetched.
+
+        Notes
+        -----
+        All user names are hashed and all unknown keys are fetched in
+        parallel. The fetched keys are saved to the key storage at once.
+
+        """
+        pool = ThreadPool(self.pool.workers)
+        cache = self.pool.users
+
+        def hash(user):
+            return Pssst._User(user, cache=cache)
+
+        def find(user):
+            try:
+                return (user, self.find(user, timeout))
+            except Exception as ex:
+                return (user, ex)
+
+        try:
+            users = dict((u.name, u) for u in pool.map(hash, users))
+            known = set(self.keys.list())
+            found = pool.map(find, [u for u in users if u not in known])
+        finally:
+            pool.terminate()
+
+        failed = dict((u, str(k)) for u, k in found if isinstance(k, Exception))
+        keys = dict((u, k) for u, k in found if u not in failed)
+
+        if keys:
+            self.keys.update(keys)
+
+        for user in users:
+            if user not in failed and user not in self.pool.keys:
+                key = keys.get(user) or self.keys.load(user)
+                self.pool.keys[user] = Pssst._Key(key)
+
+        return failed
+
+    def fetch(self, timeout=None):
+        """
+        Pulls all messages from the box into the inbox.
+
+        Parameters
+        ----------
+        param timeout : float, optional (default is None)
+            Deadline of this call in seconds.
+
+        Returns
+        -------
+        int
+            The number of fetched messages.
+
+        Notes
+        -----
+        The messages are stored encrypted in a local SQLite database, along
+        with their session keys, and will only be decrypted if they are
+        returned by the inbox method. Malformed messages are dropped.
+
+        """
+        path = self.user.hash + "/box"
+        box = self.__request_api("GET", path, timeout=timeout) or []
+        text = (str, type(u""), type(None))
+        rows = []
+
+        for message in box:
+            try:
+                nonce = _decode(message["nonce"])
+                data = _decode(message["data"])
+            except Exception:
+                continue # Can never be decrypted
+
+            session, key = message.get("session"), message.get("key")
+
+            if isinstance(session, text) and isinstance(key, text):
+                rows.append((nonce, data, session, key))
+
+        self.box.append(rows)
+
+        return len(rows)
+
+    def inbox(self, cursor=0, limit=100, since=0, buffer=False):
+        """
+        Returns a page of messages from the inbox.
+
+        Parameters
+        ----------
+        param cursor : int, optional (default is 0)
+            Return only messages after this message id.
+        param limit : int, optional (default is 100)
+            Maximum number of messages.
+        param since : int, optional (default is 0)
+            Return only messages fetched since this timestamp (EPOCH).
+        param buffer : bool, optional (default is False)
+            Return the decryption buffers without copying them.
+
+        Returns
+        -------
+        list of tuples
+            The message id, timestamp and data (None if not decryptable).
+
+        Notes
+        -----
+        Use the id of the last message as cursor for the next page. Messages
+        stay in the inbox until they are removed with the discard method.
+        The sessions of a page are registered only now, so a forged session
+        key only makes its own messages undecryptable.
+
+        """
+        rows = self.box.query(cursor, limit, since)
+        sessions = set(row[2] for row in rows if row[2]) - set(self.secrets)
+
+        if sessions:
+            self.__register(self.box.keys(sessions))
+
+        data = []
+
+        for id, timestamp, session, nonce, message in rows:
+            try:
+                message = self.__decrypt(bytes(nonce), message, session)
+            except Exception:
+                message = None # Forged or corrupt message
+
+            data.append((id, timestamp, message))
+
+        return data if buffer else [(id, timestamp, (
+            bytes(message) if message is not None else None
+        )) for id, timestamp, message in data]
+
+    def discard(self, ids):
+        """
+        Removes messages from the inbox.
+
+        Parameters
+        ----------
+        param ids : list of ints
+            The message ids.
+
+        """
+        self.box.remove(ids)
+
+    def stats(self):
+        """
+        Returns the request latency statistics.
+
+        Returns
+        -------
+        dict
+            The number of sampled requests and the latency percentiles.
+
+        Notes
+        -----
+        Only the latest 1000 requests are sampled. All latencies are given
+        in seconds and include neither retries nor backoff delays.
+
+        """
+        return _percentiles(self.latency)
+
+
+class PssstPool:
+    """
+    Pssst multi account manager class.
+
+    Methods
+    -------
+    add(username, password)
+        Adds an account.
+    get(username)
+        Returns an account.
+    remove(username)
+        Removes an account.
+    pull()
+        Pulls all messages from all boxes concurrently.
+    push(username, receiver, messages, session)
+        Pushes a stream of messages concurrently.
+    request(method, url, **kwargs)
+        Returns the response of a pooled HTTP request.
+    stats()
+        Returns the aggregated statistics.
+
+    """
+    WORKERS, BATCH, HOSTS = 8, 256, 32
+
+    def __init__(self, server=None, workers=None, timeout=None):
+        """
+        Initializes the instance with an empty account list.
+
+        Parameters
+        ----------
+        param server : string or list, optional (default is None)
+            Server address (or addresses, if sharded) of all accounts.
+        param workers : int, optional (default is None)
+            Maximum number of concurrent requests.
+        param timeout : float, optional (default is None)
+            Deadline for every call in seconds.
+
+        Notes
+        -----
+        All accounts share one HTTP connection pool (per server), the server
+        keys, the public keys of the receivers and the hashed user names.
+
+        """
+        self.api = server
+        self.timeout = timeout
+        self.workers = workers or PssstPool.WORKERS
+        self.accounts = {}
+        self.servers = {}
+        self.users = {}
+        self.keys = {}
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.counter = {"pulls": 0, "messages": 0, "bytes": 0}
+        self.session = Session()
+
+        adapter = HTTPAdapter(PssstPool.HOSTS, self.workers)
+
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __len__(self):
+        """
+        Returns the number of accounts.
+
+        Returns
+        -------
+        int
+            The number of accounts.
+
+        """
+        return len(self.accounts)
+
+    def add(self, username, password):
+        """
+        Adds an account.
+
+        Parameters
+        ----------
+        param username : string
+            User name.
+        param password : string
+            User private key password.
+
+        Returns
+        -------
+        Pssst
+            The account.
+
+        """
+        pssst = Pssst(username, password, self.api, self.timeout, self)
+
+        self.accounts[pssst.user.name] = pssst
+
+        return pssst
+
+    def get(self, username):
+        """
+        Returns an account.
+
+        Parameters
+        ----------
+        param username : string
+            User name.
+
+        Returns
+        -------
+        Pssst
+            The account.
+
+        """
+        return self.accounts[Pssst._User(username, cache=self.users).name]
+
+    def remove(self, username):
+        """
+        Removes an account.
+
+        Parameters
+        ----------
+        param username : string
+            User name.
+
+        """
+        del self.accounts[Pssst._User(username, cache=self.users).name]
+
+    def pull(self):
+        """
+        Pulls all messages from all boxes concurrently.
+
+        Returns
+        -------
+        dict
+            The message data of every account.
+
+        Notes
+        -----
+        Errors are returned as the result of the respective account.
+
+        """
+        def pull(pssst):
+            try:
+                data = pssst.pull()
+            except Exception as ex:
+                return (pssst.user.name, ex)
+
+            with self.lock:
+                self.counter["pulls"] += 1
+                self.counter["messages"] += len(data)
+                self.counter["bytes"] += sum(len(item) for item in data)
+
+            return (pssst.user.name, data)
+
+        pool = ThreadPool(min(self.workers, max(1, len(self.accounts))))
+
+        try:
+            return dict(pool.map(pull, list(self.accounts.values())))
+        finally:
+            pool.terminate()
+
+    def push(self, username, receiver, messages, session=False):
+        """
+        Pushes a stream of messages concurrently.
+
+        Parameters
+        ----------
+        param username : string
+            User name of the sending account.
+        param receiver : string
+            User name of the receiver.
+        param messages : iterable of byte strings
+            The message data.
+        param session : bool, optional (default is False)
+            Encrypt with the session key of the receiver.
+
+        Returns
+        -------
+        int
+            The number of pushed messages.
+
+        Notes
+        -----
+        The messages are consumed in batches, so only one batch is held in
+        memory at a time. The first message is pushed alone, to look up the
+        receivers key only once. As the messages of a batch are pushed
+        concurrently, their order in the box is not kept.
+
+        """
+        pssst, count = self.get(username), 0
+        messages = iter(messages)
+
+        def push(data):
+            pssst.push(receiver, data, session=session)
+
+        for data in messages:
+            push(data)
+            count += 1
+            break
+
+        pool = ThreadPool(self.workers)
+
+        try:
+            while True:
+                batch = list(islice(messages, PssstPool.BATCH))
+
+                if not batch:
+                    return count
+
+                pool.map(push, batch)
+                count += len(batch)
+        finally:
+            pool.terminate()
+
+    def request(self, method, url, **kwargs):
+        """
+        Returns the response of a pooled HTTP request.
+
+        Parameters
+        ----------
+        param method : string
+            Request method.
+        param url : string
+            Request URL.
+        param kwargs : dict
+            Request arguments.
+
+        Returns
+        -------
+        Response
+            The response object.
+
+        """
+        return self.session.request(method, url=url, **kwargs)
+
+    def stats(self):
+        """
+        Returns the aggregated statistics.
+
+        Returns
+        -------
+        dict
+            The counters, throughput and latency of all accounts.
+
+        """
+        latency = []
+
+        for pssst in list(self.accounts.values()):
+            latency.extend(pssst.latency)
+
+        with self.lock:
+            stats, elapsed = dict(self.counter), time.time() - self.start
+
+        stats.update(_percentiles(latency))
+        stats.update({
+            "accounts": len(self.accounts),
+            "elapsed": elapsed,
+            "messages/s": stats["messages"] / float(elapsed),
+            "bytes/s": stats["bytes"] / float(elapsed)
+        })
+
+        return stats
+
+
+class PssstProfiler:
+    """
+    Pssst profiler for a sample of calls.
+
+    Methods
+    -------
+    dump(file)
+        Writes the collected profile to a file.
+    hotspots(limit)
+        Returns the most expensive Pssst methods.
+    report(stream, limit)
+        Prints the most expensive Pssst methods.
+
+    Notes
+    -----
+    Use an instance as context manager around the calls to profile. Only a
+    random sample (of the given rate) of all calls will be profiled with the
+    deterministic profiler, the others run without any overhead. Threads
+    started by a sampled call (e.g. the workers of a pool) are profiled
+    too, and merged into the same profile.
+
+    """
+    TARGETS = ("_User", "_Key", "_KeyStorage", "__request_api")
+
+    def __init__(self, rate=1.0):
+        """
+        Initializes the instance with an empty profile.
+
+        Parameters
+        ----------
+        param rate : float, optional (default is 1.0)
+            The sampling rate of the calls (0.0 to 1.0).
+
+        """
+        self.rate = rate
+        self.calls = 0
+        self.sampled = 0
+        self.stats = None
+        self.threads = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def __enter__(self):
+        """
+        Starts profiling this call (if sampled).
+
+        Returns
+        -------
+        PssstProfiler
+            The instance.
+
+        """
+        self.calls += 1
+        self.local.profile = None
+
+        if random.random() < self.rate:
+            profile = cProfile.Profile()
+
+            try:
+                profile.enable()
+            except ValueError:
+                return self # Another profiler is active
+
+            self.local.profile = profile
+
+            threading.setprofile(self.__thread)
+
+        return self
+
+    def __thread(self, frame, event, arg):
+        """
+        Starts profiling a thread started by a sampled call.
+
+        Parameters
+        ----------
+        param frame : frame
+            The current stack frame.
+        param event : string
+            The profile event.
+        param arg : mixed
+            The event argument.
+
+        Notes
+        -----
+        Called only for the first event of the thread. Since Python 3.12, a
+        single profiler covers all threads and the thread is not profiled
+        separately.
+
+        """
+        sys.setprofile(None)
+
+        profile = cProfile.Profile()
+
+        try:
+            profile.enable()
+        except ValueError:
+            return # Another profiler is active
+
+        with self.lock:
+            self.threads.append(profile)
+
+    def __exit__(self, *exc):
+        """
+        Stops profiling this call and collects its profile.
+
+        Returns
+        -------
+        bool
+            Always False (exceptions are not suppressed).
+
+        """
+        profile, self.local.profile = self.local.profile, None
+
+        if profile:
+            threading.setprofile(None)
+            profile.disable()
+
+            with self.lock:
+                threads, self.threads = self.threads, []
+
+                for each in [profile] + threads:
+                    if self.stats:
+                        self.stats.add(each)
+                    else:
+                        self.stats = pstats.Stats(each)
+
+                self.sampled += 1
+
+        return False
+
+    def __targets(self):
+        """
+        Returns the profile keys of all target methods.
+
+        Returns
+        -------
+        dict
+            The qualified method name per profile key.
+
+        """
+        source, targets = Pssst.__init__.__code__.co_filename, {}
+
+        for target in PssstProfiler.TARGETS:
+            attr = getattr(Pssst, target, None)
+
+            if attr is None:
+                attr = getattr(Pssst, "_Pssst" + target)
+                methods = {target: attr}
+                target = "Pssst"
+            else:
+                methods = vars(attr)
+
+            for name, method in methods.items():
+                method = getattr(method, "__func__", method)
+                method = getattr(method, "__wrapped__", method)
+                code = getattr(method, "__code__", None)
+
+                if code and code.co_filename == source:
+                    targets[(
+                        code.co_filename, code.co_firstlineno, code.co_name
+                    )] = "%s.%s" % (target, re.sub(
+                        "^_[A-Za-z]\\w*?(?=__)", "", name # Unmangled
+                    ))
+
+        return targets
+
+    def dump(self, file):
+        """
+        Writes the collected profile to a file.
+
+        Parameters
+        ----------
+        param file : string
+            The file name (readable with the pstats module).
+
+        """
+        if self.stats:
+            self.stats.dump_stats(file)
+
+    def hotspots(self, limit=10):
+        """
+        Returns the most expensive Pssst methods.
+
+        Parameters
+        ----------
+        param limit : int, optional (default is 10)
+            Maximum number of methods.
+
+        Returns
+        -------
+        list of tuples
+            The method name, calls, own and total time in seconds (sorted by
+            the total time).
+
+        """
+        if not self.stats:
+            return []
+
+        targets = self.__targets()
+
+        return sorted([
+            (targets[key], calls, own, total)
+            for key, (_, calls, own, total, _) in self.stats.stats.items()
+            if key in targets
+        ], key=lambda hotspot: -hotspot[3])[:limit]
+
+    def report(self, stream=None, limit=10):
+        """
+        Prints the most expensive Pssst methods.
+
+        Parameters
+        ----------
+        param stream : file, optional (default is None)
+            The output stream (default is the standard error).
+        param limit : int, optional (default is 10)
+            Maximum number of methods.
+
+        """
+        stream = stream or sys.stderr
+
+        stream.write("Profile: %s of %s calls sampled (%.3fs)\n" % (
+            self.sampled, self.calls, self.stats.total_tt if self.stats else 0
+        ))
+        stream.write("  %-32s %8s %10s %10s\n" % (
+            "Hot spots", "Calls", "Own", "Total"
+        ))
+
+        for name, calls, own, total in self.hotspots(limit):
+            stream.write("  %-32s %8s %9.3fs %9.3fs\n" % (
+                name, calls, own, total
+            ))
 
 
 class CLI:
@@ -540,10 +2134,28 @@ class CLI:
     --------------
     profile(username)
         Returns the profile properties.
+    account(username)
+        Returns the pool and account of a profile (cached).
+    batch(script, source)
+        Runs the commands of a batch file.
+    profiled(script, *args)
+        Runs a command with the profiler.
+    stdin()
+        Returns the binary standard input.
+    stdout()
+        Returns the binary standard output.
+    read(stream, framing)
+        Returns the messages read from a stream.
+    write(stream, data, framing)
+        Writes a message to a stream.
     usage(text, *args)
         Prints the usage colored.
 
     """
+    FRAME = struct.Struct(">I")
+
+    accounts, pools = {}, {}
+
     @staticmethod
     def profile(username="~"):
         """
@@ -578,6 +2190,256 @@ class CLI:
 
         return (username, password, server)
 
+    @staticmethod
+    def account(username="~"):
+        """
+        Returns the pool and account of a profile (cached).
+
+        Parameters
+        ----------
+        param username : string, optional (default is ~)
+            The username or profile directory.
+
+        Returns
+        -------
+        tuple
+            The pool and the account.
+
+        Notes
+        -----
+        Every profile is loaded once per process and all accounts of the
+        same server share one pool, so consecutive commands (as in a batch)
+        do not derive and decrypt the private key again.
+
+        """
+        if username not in CLI.accounts:
+            name, password, server = CLI.profile(username)
+
+            if server not in CLI.pools:
+                CLI.pools[server] = PssstPool(server)
+
+            pool = CLI.pools[server]
+
+            CLI.accounts[username] = (pool, pool.add(name, password))
+
+        return CLI.accounts[username]
+
+    @staticmethod
+    def batch(script, source="-"):
+        """
+        Runs the commands of a batch file.
+
+        Parameters
+        ----------
+        param script : string
+            The script name.
+        param source : string, optional (default is -)
+            The batch file (or - for the standard input).
+
+        Returns
+        -------
+        int
+            The number of failed commands.
+
+        Notes
+        -----
+        Every line holds one command with its arguments, as given on the
+        command line (shell quoting applies). Empty lines and lines starting
+        with # are skipped. The status of every command and the total time
+        are written to the standard error. An interrupt stops the whole
+        batch, not only the current command.
+
+        """
+        if source in ("-", "~"):
+            lines = sys.stdin.readlines()
+        else:
+            with io.open(source) as file:
+                lines = file.readlines()
+
+        start, failed, count = time.time(), 0, 0
+
+        for number, line in enumerate(lines, 1):
+            args = shlex.split(line, comments=True)
+
+            if not args:
+                continue
+
+            if args[0] in ("-b", "--batch"):
+                result = "Error: Batch not allowed"
+            else:
+                timer = time.time()
+                result = main(script, *args)
+                timer = time.time() - timer
+
+            count += 1
+            sys.stdout.flush()
+
+            if result:
+                failed += 1
+                sys.stderr.write("Line %s: %s (%s)\n" % (
+                    number, args[0], result
+                ))
+            else:
+                sys.stderr.write("Line %s: %s OK (%.3fs)\n" % (
+                    number, args[0], timer
+                ))
+
+            if result == "Abort":
+                break
+
+        sys.stderr.write("Batch: %s commands, %s failed (%.3fs)\n" % (
+            count, failed, time.time() - start
+        ))
+
+        if count and result == "Abort":
+            raise KeyboardInterrupt()
+
+        return failed
+
+    @staticmethod
+    def profiled(script, *args):
+        """
+        Runs a command with the profiler.
+
+        Parameters
+        ----------
+        param script : string
+            The script name.
+        param args : tuple of strings
+            The command and its arguments.
+
+        Returns
+        -------
+        mixed
+            The result of the command.
+
+        Notes
+        -----
+        The profile is written to the file given by the environment variable
+        'PSSST_PROFILE' (default is pssst.prof) and the hot spots are printed
+        to the standard error.
+
+        """
+        profiler = PssstProfiler()
+
+        try:
+            with profiler:
+                return main(script, *args)
+        finally:
+            profiler.dump(os.environ.get("PSSST_PROFILE") or "pssst.prof")
+            profiler.report()
+
+    @staticmethod
+    def stdin():
+        """
+        Returns the binary standard input.
+
+        """
+        return getattr(sys.stdin, "buffer", sys.stdin)
+
+    @staticmethod
+    def stdout():
+        """
+        Returns the binary standard output.
+
+        """
+        return getattr(sys.stdout, "buffer", sys.stdout)
+
+    @staticmethod
+    def read(stream, framing="lines"):
+        """
+        Returns the messages read from a stream.
+
+        Parameters
+        ----------
+        param stream : file
+            The binary input stream.
+        param framing : string, optional (default is lines)
+            The stream format (lines or frames).
+
+        Returns
+        -------
+        generator of byte strings
+            The message data.
+
+        Raises
+        ------
+        Exception
+            Because the stream format is unknown.
+        Exception
+            Because the stream was truncated.
+
+        """
+        if framing == "lines":
+            for line in stream:
+                yield line[:-1] if line.endswith(b"\n") else line
+
+        elif framing == "frames":
+            while True:
+                head = stream.read(CLI.FRAME.size)
+
+                if not head:
+                    break
+
+                if len(head) < CLI.FRAME.size:
+                    raise Exception("Stream truncated")
+
+                size = CLI.FRAME.unpack(head)[0]
+                data = stream.read(size)
+
+                if len(data) < size:
+                    raise Exception("Stream truncated")
+
+                yield data
+
+        else:
+            raise Exception("Stream format unknown")
+
+    @staticmethod
+    def write(stream, data, framing="lines"):
+        """
+        Writes a message to a stream.
+
+        Parameters
+        ----------
+        param stream : file or string
+            The binary output stream or a directory.
+        param data : byte string
+            The message data.
+        param framing : string, optional (default is lines)
+            The stream format (raw, lines or frames).
+
+        Raises
+        ------
+        Exception
+            Because the stream format is unknown.
+
+        Notes
+        -----
+        If a directory is given, every message is written to its own file.
+
+        """
+        if not hasattr(stream, "write"):
+            prefix = "%.6f-" % time.time()
+            handle, path = mkstemp(".pssst", prefix, stream)
+
+            with io.open(handle, "wb") as file:
+                file.write(data)
+
+        elif framing == "raw":
+            stream.write(data)
+
+        elif framing == "lines":
+            stream.write(data)
+            stream.write(b"\n")
+
+        elif framing == "frames":
+            stream.write(CLI.FRAME.pack(len(data)))
+            stream.write(data)
+
+        else:
+            raise Exception("Stream format unknown")
+
     @staticmethod
     def usage(text, *args):
         """
@@ -611,7 +2473,7 @@ class CLI:
 
                 # Color list points
                 elif re.match("^  (-.|[a-z]+)", line):
-                    line = line.replace("   ", "   \x1B[37;0m")
+                    line = line.replace("   ", "   \x1B[37;0m", 1)
                     line = "\x1B[34;1m%s\x1B[0m" % line
 
             print(line)
@@ -631,21 +2493,39 @@ def main(script, command="--help", username="~", receiver=None, *message):
       %s [option|command] [~|username:password@server] [receiver message...]
 
     Options:
+      -b, --batch     Runs commands from a file [file|-]
       -h, --help      Shows the usage
       -l, --license   Shows the license
+      -p, --profile   Profiles a command [command...]
       -v, --version   Shows the version
 
     Available commands:
-      create   Create user
-      delete   Delete user
-      pull     Pull messages
-      push     Push message
+      create     Create user
+      delete     Delete user
+      dump       Pull messages to stdout [lines|frames|raw|directory]
+      pipe       Push messages from stdin [receiver lines|frames]
+      prefetch   Prefetch user keys [receiver...|-]
+      pull       Pull messages [limit]
+      push       Push message
+
+    Stream formats:
+      lines      Newline delimited (default)
+      frames     Length prefixed (4 bytes, big endian)
+      raw        Unframed (dump only)
 
     Report bugs to <christian@uhsat.de>
     """
     try:
+        if command in ("-b", "--batch"):
+            return 1 if CLI.batch(script, username) else None
+
+        if command in ("-p", "--profile"):
+            return CLI.profiled(script, *[
+                arg for arg in (username, receiver) + message if arg
+            ])
+
         if username:
-            pssst = Pssst(*CLI.profile(username))
+            pool, pssst = CLI.account(username)
 
         if command in ("/?", "-h", "--help", "help"):
             CLI.usage(main.__doc__, __version__, os.path.basename(script))
@@ -664,6 +2544,11 @@ def main(script, command="--help", username="~", receiver=None, *message):
             pssst.delete()
             print("Deleted %s" % pssst.user)
 
+        elif command in ("--pull", "pull") and username and receiver:
+            for page in pssst.pages(int(receiver)):
+                for data in page:
+                    print(data.decode("utf-8"))
+
         elif command in ("--pull", "pull") and username:
             for data in pssst.pull():
                 print(data.decode("utf-8"))
@@ -672,6 +2557,42 @@ def main(script, command="--help", username="~", receiver=None, *message):
             pssst.push(receiver, " ".join(message))
             print("Message send")
 
+        elif command in ("--dump", "dump") and username:
+            if receiver and os.path.isdir(receiver):
+                stream, framing = receiver, None
+            else:
+                stream, framing = CLI.stdout(), receiver or "lines"
+
+            # Assert the format before the box is emptied
+            if framing not in (None, "lines", "frames", "raw"):
+                raise Exception("Stream format unknown")
+
+            # Pages are acknowledged only after they were written
+            for page in pssst.pages(buffer=True):
+                for data in page:
+                    CLI.write(stream, data, framing)
+
+                if hasattr(stream, "flush"):
+                    stream.flush()
+
+        elif command in ("--prefetch", "prefetch") and username and receiver:
+            if receiver == "-":
+                users = [u.decode("utf-8") for u in CLI.read(CLI.stdin())]
+            else:
+                users = [receiver] + list(message)
+
+            failed = pssst.prefetch(users)
+
+            for user, error in sorted(failed.items()):
+                sys.stderr.write("Error: %s %s\n" % (user, error))
+
+            print("Prefetched %s keys" % (len(set(users)) - len(failed)))
+
+        elif command in ("--pipe", "pipe") and username and receiver:
+            messages = CLI.read(CLI.stdin(), (message or ["lines"])[0])
+            count = pool.push(pssst.user.name, receiver, messages)
+            sys.stderr.write("Messages send: %s\n" % count)
+
         else:
             print("Unknown command or invalid username: " + command)
             print("Please use --help for help on usage.")
@@ -691,4 +2612,7 @@ def main(script, command="--help", username="~", receiver=None, *message):
 
 
 if __name__ == "__main__":
+    if os.environ.get("PSSST_PROFILE"):
+        sys.exit(CLI.profiled(*sys.argv))
+
     sys.exit(main(*sys.argv))
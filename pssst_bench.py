@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2015  Christian & Christian <hello@pssst.name>
+Copyright (C) 2015-2017  Christian Uhsat <christian@uhsat.de>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import base64
+import json
+import os
+import subprocess
+import sys
+
+
+from pssst import Pssst, _decode, _envelope
+
+
+try:
+    import resource
+except ImportError:
+    sys.exit("Requires POSIX")
+
+
+try:
+    from Crypto.Cipher import AES, PKCS1_OAEP
+    from Crypto.Util.py3compat import bchr, bord, tobytes
+except ImportError:
+    sys.exit("Requires PyCrypto")
+
+
+MB = 1024 * 1024
+
+
+def peak():
+    """
+    Returns the peak resident set size of this process.
+
+    Returns
+    -------
+    int
+        The peak RSS in bytes.
+
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def buffered(key, data):
+    """
+    Returns the round tripped data (buffer code path).
+
+    Parameters
+    ----------
+    param key : Pssst._Key
+        The receivers key.
+    param data : byte string
+        The message data.
+
+    Returns
+    -------
+    bytearray
+        The decrypted data.
+
+    """
+    data, nonce = key.encrypt(data)
+    body = b"[" + _envelope(nonce, data) + b"]"
+
+    del data, nonce
+
+    message = json.loads(body.decode("utf-8"))[0]
+
+    del body
+
+    return key.decrypt(_decode(message["data"]), _decode(message["nonce"]))
+
+
+def legacy(key, data):
+    """
+    Returns the round tripped data (copying code path).
+
+    Parameters
+    ----------
+    param key : Pssst._Key
+        The receivers key.
+    param data : byte string
+        The message data.
+
+    Returns
+    -------
+    byte string
+        The decrypted data.
+
+    """
+    nonce = os.urandom(Pssst._Key.NONCE_SIZE)
+    size = AES.block_size - (len(data) % AES.block_size)
+    data = tobytes(data) + (bchr(size) * size)
+    data = AES.new(nonce[:32], AES.MODE_CBC, nonce[32:]).encrypt(data)
+    nonce = PKCS1_OAEP.new(key.key).encrypt(nonce)
+
+    body = str(json.dumps([{
+        "nonce": base64.b64encode(nonce).decode("utf-8"),
+        "data": base64.b64encode(data).decode("utf-8")
+    }], separators=(",", ":"))).encode("utf-8")
+
+    del data, nonce
+
+    message = json.loads(body.decode("utf-8"))[0]
+
+    del body
+
+    nonce = base64.b64decode(message["nonce"].encode("utf-8"))
+    nonce = PKCS1_OAEP.new(key.key).decrypt(nonce)
+    data = base64.b64decode(message["data"].encode("utf-8"))
+    data = AES.new(nonce[:32], AES.MODE_CBC, nonce[32:]).decrypt(data)
+
+    return data[:-bord(data[-1])]
+
+
+def measure(mode, size):
+    """
+    Prints the peak RSS growth of one round trip.
+
+    Parameters
+    ----------
+    param mode : string
+        The code path (buffered or legacy).
+    param size : int
+        The payload size in megabytes.
+
+    Notes
+    -----
+    The peak RSS of a process never shrinks, so every measurement must be
+    run in its own process.
+
+    """
+    key = Pssst._Key()
+    data = os.urandom(int(size) * MB)
+    before = peak()
+
+    assert {"buffered": buffered, "legacy": legacy}[mode](key, data) == data
+
+    print(peak() - before)
+
+
+def main(script, *args):
+    """
+    Prints the peak RSS per MB of payload for both code paths.
+
+    Parameters
+    ----------
+    param script : string
+        The script name.
+    param args : tuple of strings, optional
+        Payload sizes in megabytes (default is 1, 4 and 16).
+
+    """
+    if args[:1] == ("--measure",):
+        return measure(*args[1:])
+
+    print("%8s %10s %10s" % ("Payload", "Buffered", "Legacy"))
+
+    for size in args or ("1", "4", "16"):
+        result = []
+
+        for mode in ("buffered", "legacy"):
+            output = subprocess.check_output([
+                sys.executable, script, "--measure", mode, size
+            ])
+
+            result.append(int(output) / float(int(size) * MB))
+
+        print("%6s MB %7.2f MB %7.2f MB" % tuple([size] + result))
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv))
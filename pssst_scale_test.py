@@ -0,0 +1,599 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2015  Christian & Christian <hello@pssst.name>
+Copyright (C) 2015-2017  Christian Uhsat <christian@uhsat.de>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import os
+import random
+import re
+import shutil
+import string
+import sys
+import tempfile
+import threading
+import time
+
+
+from pssst import Pssst, PssstPool, _decode, _encode
+
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+
+try:
+    import resource
+except ImportError:
+    resource = None # Optional (POSIX only)
+
+
+try:
+    import pytest
+except ImportError:
+    sys.exit("Requires py.test")
+
+
+SOAK = float(os.environ.get("PSSST_SOAK", 10))
+KEYS = int(os.environ.get("PSSST_KEYS", 10000))
+
+
+ENVIRON = ("HOME", "USERPROFILE", "PSSST")
+
+
+pytestmark = pytest.mark.skipif(
+    "not os.environ.get('PSSST_SCALE')", reason="Requires PSSST_SCALE=1"
+)
+
+
+class StandIn(ThreadingMixIn, HTTPServer):
+    """
+    Offline stand-in for the Pssst server (in-memory, single process).
+
+    Methods
+    -------
+    start()
+        Starts serving in a background thread.
+
+    Notes
+    -----
+    Implements the same API, signatures and user limit as the server, but
+    no expiry, so the client can be measured without Redis and Node.
+
+    """
+    LIMIT, PAGE = 1024 * 1024, 1000
+
+    PUBLIC = [("GET", "/key"), ("PUT", "/box")]
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), StandInHandler)
+
+        self.key = Pssst._Key()
+        self.lock = threading.Lock()
+        self.users = {}
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return "http://%s:%s" % self.server_address
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the stand-in server.
+
+    """
+    protocol_version = "HTTP/1.1"
+
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status, body=b"", mime="text/plain"):
+        if not isinstance(body, bytes):
+            body = body.encode("utf-8")
+
+        timestamp, signature = self.server.key.sign(body)
+
+        self.send_response(status)
+        self.send_header("content-type", mime)
+        self.send_header("content-length", str(len(body)))
+        self.send_header("x-pssst-hash", "%s; %s" % (
+            timestamp, _encode(signature)
+        ))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def verify(self, body, key):
+        head = self.headers.get("x-pssst-hash", "")
+
+        if not key:
+            return self.send(404, "Verification failed")
+
+        if not re.match("^[0-9]+; ?[A-Za-z0-9\+/]+=*$", head):
+            return self.send(400, "Verification failed")
+
+        timestamp, signature = head.split(";", 1)
+        timestamp, signature = int(timestamp), _decode(signature.strip())
+
+        if not Pssst._Key(key).verify(body, timestamp, signature):
+            return self.send(401, "Verification failed")
+
+        return True
+
+    def handle_any(self):
+        size = int(self.headers.get("content-length") or 0)
+        body = self.rfile.read(size) if size else b""
+        url = urlparse(self.path)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+
+        if url.path == "/key":
+            return self.send(200, self.server.key.public())
+
+        match = re.match("^/2/([a-z0-9]{64})(/key|/box)?$", url.path)
+
+        if not match:
+            return self.send(404, "Not found")
+
+        hash, route = match.groups()
+
+        with self.server.lock:
+            user = self.server.users.get(hash)
+
+            if self.command == "POST" and not route:
+                key = json.loads(body.decode("utf-8")).get("key")
+
+                if not self.verify(body, key):
+                    return
+            elif (self.command, route) not in StandIn.PUBLIC:
+                if not self.verify(body, user and user["key"]):
+                    return
+
+            if user is None and self.command != "POST":
+                return self.send(404, "User not found")
+
+            if user is not None and user["key"] is None:
+                return self.send(410, "User was deleted")
+
+            if self.command == "POST":
+                if user is not None:
+                    return self.send(409, "User already exists")
+
+                self.server.users[hash] = {
+                    "key": key, "box": [], "size": 0, "seq": 0
+                }
+
+                return self.send(200, "User created")
+
+            if self.command == "DELETE":
+                user["key"], user["box"], user["size"] = None, [], 0
+
+                return self.send(200, "User deleted")
+
+            if route == "/key":
+                return self.send(200, user["key"])
+
+            if self.command == "PUT":
+                if user["size"] >= StandIn.LIMIT - len(user["key"]):
+                    return self.send(413, "User reached limit")
+
+                user["seq"] += 1
+                user["size"] += len(body)
+                user["box"].append((user["seq"], body))
+
+                return self.send(200, "Message send")
+
+            if not query:
+                box, user["box"], user["size"] = user["box"], [], 0
+            else:
+                limit = min(int(query.get("limit", 100)), StandIn.PAGE)
+                cursor = int(query.get("cursor", 0))
+
+                while user["box"] and user["box"][0][0] <= cursor:
+                    user["size"] -= len(user["box"].pop(0)[1])
+
+                box = user["box"][:limit]
+
+            data = b"[" + b",".join(data for _, data in box) + b"]"
+
+            if query:
+                data = ('{"cursor":%d,"more":%s,"box":' % (
+                    box[-1][0] if box else cursor,
+                    "true" if len(user["box"]) > len(box) else "false"
+                )).encode("ascii") + data + b"}"
+
+            return self.send(200, data, "application/json")
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_any
+
+
+def setup_module(module):
+    """
+    Starts the stand-in server in a temporary home directory.
+
+    Parameters
+    ----------
+    param module : string
+        The module name.
+
+    Notes
+    -----
+    The overwritten environment variables are restored on teardown.
+
+    """
+    global environ, home, report, server
+
+    environ = dict((name, os.environ.get(name)) for name in ENVIRON)
+
+    home, report, server = tempfile.mkdtemp(), {}, StandIn()
+
+    os.environ["HOME"] = os.environ["USERPROFILE"] = home
+    os.environ["PSSST"] = server.start()
+
+
+def teardown_module(module):
+    """
+    Stops the stand-in server, restores the environment and writes the
+    report.
+
+    Parameters
+    ----------
+    param module : string
+        The module name.
+
+    Notes
+    -----
+    If the environment variable 'PSSST_REPORT' exists, the report will be
+    written to this file as JSON.
+
+    """
+    server.shutdown()
+    shutil.rmtree(home, True)
+
+    for name, value in environ.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+    for name, rows in sorted(report.items()):
+        sys.stdout.write("\n%s\n" % name)
+
+        for row in rows:
+            sys.stdout.write("  %s\n" % " ".join(
+                "%s=%s" % item for item in sorted(row.items())
+            ))
+
+    if os.environ.get("PSSST_REPORT"):
+        with open(os.environ["PSSST_REPORT"], "w") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+
+
+def create_profile(length=16):
+    """
+    Returns a random username and password.
+
+    Parameters
+    ----------
+    param length : int, optional (default is 16)
+        Length of the username and password in characters.
+
+    Returns
+    -------
+    tuple
+        A random username and password.
+
+    """
+    pool = string.ascii_lowercase + string.digits
+    username = "".join([random.choice(pool) for x in range(length)])
+    password = "".join([random.choice(pool) for x in range(length)])
+
+    return (username, password)
+
+
+def record(name, **values):
+    """
+    Records a data point with the current peak memory.
+
+    Parameters
+    ----------
+    param name : string
+        The name of the curve.
+    param values : dict
+        The values of the data point.
+
+    """
+    if resource:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        rss = rss if sys.platform == "darwin" else rss * 1024
+
+        values["peak"] = rss
+
+    report.setdefault(name, []).append(values)
+
+
+def linear(times, factor=4.0):
+    """
+    Returns if the cost per operation did not grow super linear.
+
+    Parameters
+    ----------
+    param times : list of floats
+        The seconds per operation of every step (in order).
+    param factor : float, optional (default is 4.0)
+        Tolerated growth from the first to the last quarter.
+
+    Returns
+    -------
+    bool
+        True if the cost of the last quarter stays within the factor.
+
+    Notes
+    -----
+    The first and last quarter of the steps are averaged, and a millisecond
+    of slack is given, so that timer noise does not fail the test.
+
+    """
+    quarter = max(1, len(times) // 4)
+    first = sum(times[:quarter]) / quarter
+    last = sum(times[-quarter:]) / quarter
+
+    return last <= first * factor + 0.001
+
+
+class TestScaleBox:
+    """
+    Tests the box scaling with the test cases:
+
+    * Box limit
+    * Box pages
+
+    Methods
+    -------
+    test_box_limit()
+        Tests if a box is filled up to the limit at constant cost.
+    test_box_pages()
+        Tests if a full box is pulled page by page at constant cost.
+
+    """
+    def fill(self, pssst, size):
+        """
+        Fills the box of the user up to the limit.
+
+        Parameters
+        ----------
+        param pssst : Pssst
+            The user.
+        param size : int
+            The message size in bytes.
+
+        Returns
+        -------
+        list of floats
+            The seconds per push.
+
+        """
+        times = []
+
+        while True:
+            start = time.time()
+
+            try:
+                pssst.push(pssst.user.name, os.urandom(size))
+            except Exception as ex:
+                assert str(ex) == "User reached limit"
+                return times
+
+            times.append(time.time() - start)
+
+            if len(times) % 100 == 0:
+                record("box_push_%s" % size, messages=len(times),
+                       rate=round(100 / sum(times[-100:]), 1))
+
+    def test_box_limit(self):
+        """
+        Tests if a box is filled up to the limit at constant cost.
+
+        """
+        username, password = create_profile()
+
+        pssst = Pssst(username, password)
+        pssst.create()
+
+        times = self.fill(pssst, 512)
+
+        assert len(times) > 500
+        assert linear(times)
+
+        assert len(pssst.pull()) == len(times)
+
+    def test_box_pages(self):
+        """
+        Tests if a full box is pulled page by page at constant cost.
+
+        """
+        username, password = create_profile()
+
+        pssst = Pssst(username, password)
+        pssst.create()
+
+        count, times, pulled = len(self.fill(pssst, 4096)), [], 0
+        start = time.time()
+
+        for page in pssst.pages(20):
+            times.append(time.time() - start)
+            pulled += len(page)
+
+            record("box_pages", messages=pulled,
+                   rate=round(len(page) / times[-1], 1))
+
+            start = time.time()
+
+        assert pulled == count
+        assert pssst.pull() == []
+        assert linear(times)
+
+
+class TestScaleKeys:
+    """
+    Tests the key storage scaling with the test cases:
+
+    * Keys growth
+
+    Methods
+    -------
+    test_keys_growth()
+        Tests if the key storage grows linear up to PSSST_KEYS entries.
+
+    """
+    def test_keys_growth(self):
+        """
+        Tests if the key storage grows linear up to PSSST_KEYS entries.
+
+        Notes
+        -----
+        The keys are saved in batches of 500 entries. After every batch, a
+        single save, load and list are measured, as a push to an unknown
+        receiver does them. The number of entries can be set via the
+        environment variable 'PSSST_KEYS' (default is 10000).
+
+        """
+        username, password = create_profile()
+
+        pssst = Pssst(username, password)
+        pssst.create()
+
+        key, batch = pssst.keys.key.public(), 500
+        saves, lists, sizes = [], [], []
+
+        for offset in range(0, KEYS, batch):
+            pssst.keys.update(dict(
+                ("user%s" % n, key) for n in range(offset, offset + batch)
+            ))
+
+            start = time.time()
+            pssst.keys.save("single%s" % offset, key)
+            saves.append(time.time() - start)
+
+            start = time.time()
+            pssst.keys.list()
+            lists.append(time.time() - start)
+
+            assert pssst.keys.load("single%s" % offset) == key.encode("ascii")
+
+            sizes.append(os.path.getsize(pssst.keys.file))
+
+            record("keys_growth", entries=offset + batch, size=sizes[-1],
+                   save=round(saves[-1], 6), list=round(lists[-1], 6))
+
+        total = batch * len(saves)
+
+        assert len(pssst.keys.list()) == total + len(saves) + 1
+
+        # Saves rewrite the zip directory and lists scan all entries, so
+        # their cost may grow with the entries, but not any faster
+        assert linear(saves, len(saves))
+        assert linear(lists, len(lists))
+
+        # Bytes per entry must stay constant
+        assert sizes[-1] / float(total) <= sizes[0] / float(batch) * 1.5
+
+
+class TestScaleSoak:
+    """
+    Tests sustained load with the test cases:
+
+    * Soak cycles
+
+    Methods
+    -------
+    test_soak_cycles()
+        Tests push and pull cycles for PSSST_SOAK seconds.
+
+    """
+    def test_soak_cycles(self):
+        """
+        Tests push and pull cycles for PSSST_SOAK seconds.
+
+        Notes
+        -----
+        Every cycle pushes a batch of messages concurrently and pulls them
+        page by page. Throughput and peak memory are recorded per cycle. The
+        duration can be set via the environment variable 'PSSST_SOAK' in
+        seconds (default is 10).
+
+        """
+        pool = PssstPool()
+        username, password = create_profile()
+
+        pssst = pool.add(username, password)
+        pssst.create()
+
+        rates, deadline, cycle = [], time.time() + SOAK, 0
+
+        while time.time() < deadline or cycle < 2:
+            messages = [
+                os.urandom(random.randint(1, 2048)) for _ in range(200)
+            ]
+
+            start = time.time()
+            pushed = pool.push(username, username, iter(messages))
+            pulled = sum(list(pssst.pages(50)), [])
+            rates.append(len(messages) / (time.time() - start))
+
+            assert pushed == len(messages)
+            assert sorted(pulled) == sorted(messages)
+
+            cycle += 1
+
+            record("soak_cycles", cycle=cycle, rate=round(rates[-1], 1))
+
+        assert linear([1 / rate for rate in rates])
+
+
+def main(*args):
+    """
+    Starts scale testing.
+
+    Parameters
+    ----------
+    param args : tuple of strings, optional
+        Arguments passed to pytest.
+
+    Notes
+    -----
+    Started directly, the scale tests are always run. Under py.test, they
+    only run if the environment variable 'PSSST_SCALE' is set.
+
+    """
+    os.environ["PSSST_SCALE"] = "1"
+
+    return pytest.main(["-s"] + list(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv))
@@ -16,13 +16,25 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
+import io
+import json
 import os
 import random
+import socket
 import string
+import subprocess
 import sys
+import threading
+import time
 
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from zipfile import ZipFile
 
-from pssst import Pssst
+
+import pssst
+
+from pssst import CLI, Pssst, PssstPool, PssstProfiler, Timeout, _encode
 
 
 try:
@@ -85,10 +97,36 @@ def create_profile(length=16):
     password = "".join([random.choice(pool) for x in range(length)])
 
     files.append(os.path.join(os.path.expanduser("~"), ".pssst." + username))
+    files.append(files[-1] + ".lock")
 
     return (username, password)
 
 
+def save_keys(args):
+    """
+    Saves keys to a shared profile (run in a separate process).
+
+    Parameters
+    ----------
+    param args : tuple
+        The username, password and names to save.
+
+    Returns
+    -------
+    list of strings
+        The names saved.
+
+    """
+    username, password, names = args
+
+    pssst = Pssst(username, password)
+
+    for name in names:
+        pssst.keys.save(name, pssst.keys.key.public())
+
+    return names
+
+
 class TestPssstUser:
     """
     Tests Pssst user name parsing with the test cases:
@@ -138,6 +176,68 @@ class TestPssstUser:
         assert str(ex.value) == "User name invalid"
 
 
+class TestPssstRing:
+    """
+    Tests Pssst sharding with the test cases:
+
+    * Ring single server
+    * Ring distribution
+    * Ring resharding
+
+    Methods
+    -------
+    test_ring_single()
+        Tests if a single server is always returned.
+    test_ring_distribution()
+        Tests if users are distributed over all servers.
+    test_ring_resharding()
+        Tests if only a fraction of users are moved.
+
+    """
+    def hashes(self, count=1000):
+        """
+        Returns random user hashes.
+
+        """
+        return ["%064x" % random.getrandbits(256) for _ in range(count)]
+
+    def test_ring_single(self):
+        """
+        Tests if a single server is always returned.
+
+        """
+        ring = Pssst._Ring("http://a.org/")
+
+        assert set(map(ring.server, self.hashes())) == set(["http://a.org"])
+
+    def test_ring_distribution(self):
+        """
+        Tests if users are distributed over all servers.
+
+        """
+        servers = ["http://%s.org" % name for name in "abcd"]
+        ring = Pssst._Ring(",".join(servers))
+        shards = [ring.server(hash) for hash in self.hashes()]
+
+        for server in servers:
+            assert shards.count(server) > 100
+
+    def test_ring_resharding(self):
+        """
+        Tests if only a fraction of users are moved.
+
+        """
+        servers = ["http://%s.org" % name for name in "abcd"]
+        ring1 = Pssst._Ring(servers)
+        ring2 = Pssst._Ring(servers + ["http://e.org"])
+        hashes = self.hashes()
+
+        moved = [h for h in hashes if ring1.server(h) != ring2.server(h)]
+
+        assert len(moved) < len(hashes) * 0.35
+        assert set(ring2.server(h) for h in moved) == set(["http://e.org"])
+
+
 class TestPsssstKey:
     """
     Tests Pssst key methods with this test cases:
@@ -209,11 +309,17 @@ class TestPsssstKeyStorage:
     Tests Pssst key storage with the test cases:
 
     * Key list
+    * Key threads
+    * Key processes
 
     Methods
     -------
     test_key_list()
         Tests if file is created correctly.
+    test_key_threads()
+        Tests if concurrent pushes save every key once.
+    test_key_processes()
+        Tests if concurrent processes save every key once.
 
     """
     def test_key_list(self):
@@ -237,6 +343,59 @@ class TestPsssstKeyStorage:
 
         assert sorted(pssst1.keys.list()) == sorted(keys)
 
+    def test_key_threads(self):
+        """
+        Tests if concurrent pushes save every key once.
+
+        """
+        username, password = create_profile()
+        receivers = []
+
+        for _ in range(4):
+            receiver, secret = create_profile()
+            Pssst(receiver, secret).create()
+            receivers.append(receiver)
+
+        pssst = Pssst(username, password)
+        pssst.create()
+
+        pool = ThreadPool(8)
+        pool.map(lambda receiver: pssst.push(receiver, "Hello"), receivers * 4)
+        pool.close()
+
+        with ZipFile(pssst.keys.file, "r") as file:
+            names = file.namelist()
+
+        assert len(names) == len(set(names))
+        assert pssst.keys.list() == sorted(["id_rsa"] + receivers)
+
+    def test_key_processes(self):
+        """
+        Tests if concurrent processes save every key once.
+
+        """
+        username, password = create_profile()
+
+        pssst = Pssst(username, password)
+        pssst.create()
+
+        batches = [["shared"] + ["user%d%d" % (n, i) for i in range(8)]
+                   for n in range(4)]
+
+        pool = Pool(4)
+        pool.map(save_keys, [(username, password, b) for b in batches])
+        pool.close()
+        pool.join()
+
+        with ZipFile(pssst.keys.file, "r") as file:
+            assert file.testzip() is None
+            names = file.namelist()
+
+        keys = sum([batch[1:] for batch in batches], ["id_rsa", "shared"])
+
+        assert len(names) == len(set(names))
+        assert pssst.keys.list() == sorted(keys)
+
 
 class TestPssst:
     """
@@ -431,6 +590,786 @@ class TestPssst:
         assert str(ex.value) == "Password wrong"
 
 
+class TestPssstInbox:
+    """
+    Tests Pssst inbox with the test cases:
+
+    * Inbox fetch
+    * Inbox paging
+
+    Methods
+    -------
+    test_inbox_fetch()
+        Tests if messages are fetched into the inbox.
+    test_inbox_paging()
+        Tests if the inbox is paged and discarded correctly.
+
+    """
+    def test_inbox_fetch(self):
+        """
+        Tests if messages are fetched into the inbox.
+
+        """
+        username, password = create_profile()
+        message = b"Hello World!"
+
+        pssst = Pssst(username, password)
+        pssst.create()
+        pssst.push(username, message)
+
+        files.append(pssst.box.file)
+
+        assert pssst.fetch() == 1
+        assert pssst.pull() == []
+        assert [data for _, _, data in pssst.inbox()] == [message]
+
+    def test_inbox_paging(self):
+        """
+        Tests if the inbox is paged and discarded correctly.
+
+        """
+        username, password = create_profile()
+        messages = [str(n).encode("ascii") for n in range(5)]
+
+        pssst = Pssst(username, password)
+        pssst.create()
+
+        files.append(pssst.box.file)
+
+        for message in messages:
+            pssst.push(username, message)
+
+        pssst.fetch()
+
+        page1 = pssst.inbox(limit=3)
+        page2 = pssst.inbox(page1[-1][0], limit=3)
+
+        assert [data for _, _, data in page1 + page2] == messages
+
+        pssst.discard([id for id, _, _ in page1])
+
+        assert pssst.inbox() == page2
+
+
+class TestPssstCodec:
+    """
+    Tests Pssst JSON codec with the test cases:
+
+    * Codec identical
+    * Codec fallback
+
+    Methods
+    -------
+    test_codec_identical()
+        Tests if the encoded bodies equal the standard library.
+    test_codec_fallback()
+        Tests if the standard library is used without a faster codec.
+
+    """
+    DATA = [
+        {"key": "-----BEGIN PUBLIC KEY-----\nA+/=\n-----END PUBLIC KEY-----"},
+        {"data": u"\u00e9\u20ac\x01\"\\/", "list": [1, None, True]},
+        {"data": u"\x7f", "float": 1e16, "int": 2 ** 64}
+    ]
+
+    def test_codec_identical(self):
+        """
+        Tests if the encoded bodies equal the standard library.
+
+        """
+        for data in TestPssstCodec.DATA:
+            body = json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+            assert pssst._dumps(data) == body
+            assert pssst._loads(body) == data
+
+    def test_codec_fallback(self, monkeypatch):
+        """
+        Tests if the standard library is used without a faster codec.
+
+        """
+        monkeypatch.setattr(pssst, "fastjson", None)
+
+        self.test_codec_identical()
+
+
+class TestPssstPages:
+    """
+    Tests Pssst pages with the test cases:
+
+    * Pages pull
+    * Pages acknowledge
+    * Pages forged
+    * Pages legacy
+
+    Methods
+    -------
+    test_pages_pull()
+        Tests if all messages are pulled page by page.
+    test_pages_acknowledge()
+        Tests if an unacknowledged page is pulled again.
+    test_pages_forged()
+        Tests if an undecryptable message does not block the box.
+    test_pages_legacy()
+        Tests if a box with unnumbered messages is paged in order.
+
+    """
+    def test_pages_pull(self):
+        """
+        Tests if all messages are pulled page by page.
+
+        """
+        username, password = create_profile()
+        messages = [str(n).encode("ascii") for n in range(5)]
+
+        pssst = Pssst(username, password)
+        pssst.create()
+
+        for message in messages:
+            pssst.push(username, message)
+
+        pages = list(pssst.pages(2))
+
+        assert [len(page) for page in pages] == [2, 2, 1]
+        assert sum(pages, []) == messages
+        assert pssst.pull() == []
+
+    def test_pages_acknowledge(self):
+        """
+        Tests if an unacknowledged page is pulled again.
+
+        """
+        username, password = create_profile()
+        messages = [str(n).encode("ascii") for n in range(3)]
+
+        pssst = Pssst(username, password)
+        pssst.create()
+
+        for message in messages:
+            pssst.push(username, message)
+
+        for page in pssst.pages(2):
+            break
+
+        assert pssst.pull() == messages
+
+    def test_pages_forged(self):
+        """
+        Tests if an undecryptable message does not block the box.
+
+        """
+        username, password = create_profile()
+
+        pssst = Pssst(username, password)
+        pssst.create()
+
+        for _ in range(2):
+            pssst._Pssst__request_api("PUT", pssst.user.hash + "/box", {
+                "nonce": _encode(b"\x00" * 256),
+                "data": _encode(b"\x00" * 16)
+            }, False)
+
+            pssst.push(username, b"Hello World!")
+
+            assert list(pssst.pages(1)) == [[], [b"Hello World!"]]
+            assert pssst.pull() == []
+
+    def test_pages_legacy(self):
+        """
+        Tests if a box with unnumbered messages is paged in order.
+
+        Notes
+        -----
+        Runs the in-memory storage of the server directly, as the stored
+        messages can not be prepared via the API. Skipped without Node.js.
+
+        """
+        username, _ = create_profile()
+
+        files.append(files[-2] + ".json")
+
+        with open(files[-1], "w") as file:
+            json.dump({username: {
+                "val": None, "expires": 0, "size": 0, "seq": 2, "box": [
+                    "1 \"0\"", "1 \"1\"", "1 1 \"2\"", "1 2 \"3\""
+                ]
+            }}, file)
+
+        script = """
+            require(process.argv[1])({snapshot: process.argv[2]}, (err, db) => {
+              var pages = [];
+              (function next(cursor) {
+                db.page(process.argv[3], cursor, 2, 0, (err, page) => {
+                  pages.push(page.box);
+                  if (pages.length === 1) db.push(process.argv[3], '"4"', {
+                    size: 1024
+                  }, () => next(page.cursor));
+                  else if (page.box.length) next(page.cursor);
+                  else console.log(JSON.stringify(pages));
+                });
+              })(0);
+            });
+        """
+
+        memory = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "server", "memory.js")
+
+        try:
+            output = subprocess.check_output([
+                "node", "-e", script, memory, files[-1], username
+            ])
+        except OSError:
+            pytest.skip("Requires Node.js")
+
+        assert json.loads(output.decode("ascii")) == [
+            ["\"0\"", "\"1\""], ["\"2\"", "\"3\""], ["\"4\""], []
+        ]
+
+
+class TestPssstPool:
+    """
+    Tests Pssst pool with the test cases:
+
+    * Pool pull
+    * Pool caches
+
+    Methods
+    -------
+    test_pool_pull()
+        Tests if all accounts are pulled.
+    test_pool_caches()
+        Tests if keys and hashes are shared.
+
+    """
+    def test_pool_pull(self):
+        """
+        Tests if all accounts are pulled.
+
+        """
+        pool = PssstPool(workers=4)
+        users = [create_profile() for _ in range(8)]
+
+        for username, password in users:
+            pool.add(username, password).create()
+
+        for username, _ in users:
+            pool.get(users[0][0]).push(username, username.encode("ascii"))
+
+        result = pool.pull()
+        stats = pool.stats()
+
+        for username, _ in users:
+            assert result[username] == [username.encode("ascii")]
+
+        assert stats["accounts"] == len(users)
+        assert stats["messages"] == len(users)
+
+    def test_pool_caches(self):
+        """
+        Tests if keys and hashes are shared.
+
+        """
+        pool = PssstPool()
+        username1, password1 = create_profile()
+        username2, password2 = create_profile()
+
+        pssst1 = pool.add(username1, password1)
+        pssst1.create()
+
+        pssst2 = pool.add(username2, password2)
+        pssst2.push(username1, b"Hello World!")
+
+        assert pssst1.pool is pool
+        assert pssst2.pool is pool
+        assert username1 in pool.keys
+        assert username1 in pool.users
+        assert len(pool.servers) == 1
+        assert pssst1.pull() == [b"Hello World!"]
+
+
+class TestPssstPrefetch:
+    """
+    Tests Pssst key prefetching with the test cases:
+
+    * Prefetch users
+    * Prefetch user not found
+
+    Methods
+    -------
+    test_prefetch_users()
+        Tests if all user keys are prefetched.
+    test_prefetch_user_not_found()
+        Tests if an unknown user is reported.
+
+    """
+    def test_prefetch_users(self):
+        """
+        Tests if all user keys are prefetched.
+
+        """
+        users = [create_profile() for _ in range(4)]
+
+        for username, password in users:
+            Pssst(username, password).create()
+
+        pssst = Pssst(*create_profile())
+
+        assert pssst.prefetch([username for username, _ in users]) == {}
+
+        for username, _ in users:
+            assert username in pssst.keys.list()
+            assert username in pssst.pool.keys
+
+    def test_prefetch_user_not_found(self):
+        """
+        Tests if an unknown user is reported.
+
+        """
+        pssst = Pssst(*create_profile())
+
+        assert pssst.prefetch(["usernotfound"]) == {
+            "usernotfound": "User not found"
+        }
+
+
+class TestPssstSession:
+    """
+    Tests Pssst session keys with the test cases:
+
+    * Session push
+    * Session rotation
+    * Session forged
+
+    Methods
+    -------
+    test_session_push()
+        Tests if session messages are decrypted.
+    test_session_rotation()
+        Tests if sessions are rotated.
+    test_session_forged()
+        Tests if a forged session key is neither saved nor fatal.
+
+    """
+    def test_session_push(self):
+        """
+        Tests if session messages are decrypted.
+
+        """
+        username1, password1 = create_profile()
+        username2, password2 = create_profile()
+        messages = [str(n).encode("ascii") for n in range(5)]
+
+        pssst1 = Pssst(username1, password1)
+        pssst1.create()
+
+        pssst2 = Pssst(username2, password2)
+
+        for message in messages:
+            pssst2.push(username1, message, session=True)
+
+        assert pssst1.pull() == messages
+        assert len(pssst1.secrets) == 1
+        assert username1 in pssst2.keys.list()
+        assert sorted(pssst1.keys.list()) == ["id_rsa"]
+
+        pssst2.push(username1, b"Hello World!", session=True)
+
+        pssst1 = Pssst(username1, password1)
+
+        assert pssst1.pull() == [b"Hello World!"]
+
+    def test_session_rotation(self):
+        """
+        Tests if sessions are rotated.
+
+        """
+        username, password = create_profile()
+        messages = [str(n).encode("ascii") for n in range(5)]
+        original = Pssst._Session.MESSAGES
+
+        pssst = Pssst(username, password)
+        pssst.create()
+
+        try:
+            Pssst._Session.MESSAGES = 2
+
+            for message in messages:
+                pssst.push(username, message, session=True)
+        finally:
+            Pssst._Session.MESSAGES = original
+
+        assert pssst.pull() == messages
+        assert len(pssst.secrets) == 3
+
+    def test_session_forged(self):
+        """
+        Tests if a forged session key is neither saved nor fatal.
+
+        """
+        username, password = create_profile()
+
+        pssst = Pssst(username, password)
+        pssst.create()
+
+        files.append(pssst.box.file)
+
+        pssst._Pssst__request_api("PUT", pssst.user.hash + "/box", {
+            "nonce": _encode(b"\x00" * 16),
+            "data": _encode(b"\x00" * 16),
+            "session": "0123456789abcdef",
+            "key": _encode(b"\x00" * 256)
+        }, False)
+
+        pssst.push(username, b"Hello World!", session=True)
+
+        assert pssst.fetch() == 2
+        assert [data for _, _, data in pssst.inbox()] == [
+            None, b"Hello World!"
+        ]
+        assert "session-0123456789abcdef" not in pssst.keys.list()
+
+
+class TestPssstTimeout:
+    """
+    Tests Pssst request deadlines with the test cases:
+
+    * Deadline exceeded
+    * Deadline trickled
+
+    Methods
+    -------
+    test_deadline_exceeded()
+        Tests if a stalled server raises a timeout.
+    test_deadline_trickled()
+        Tests if a slowly sending server raises a timeout.
+
+    """
+    def test_deadline_exceeded(self):
+        """
+        Tests if a stalled server raises a timeout.
+
+        Notes
+        -----
+        The server accepts connections, but will never respond.
+
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(8)
+
+        api = "http://127.0.0.1:%s" % server.getsockname()[1]
+
+        try:
+            with pytest.raises(Timeout):
+                Pssst(*create_profile(), server=api, timeout=1)
+        finally:
+            server.close()
+
+    def test_deadline_trickled(self):
+        """
+        Tests if a slowly sending server raises a timeout.
+
+        Notes
+        -----
+        The server responds, but sends only one byte of the body every
+        100 milliseconds, so no single read ever times out.
+
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(8)
+
+        def trickle():
+            try:
+                while True:
+                    client, _ = server.accept()
+                    client.recv(4096)
+                    client.sendall(b"HTTP/1.1 200 OK\r\n"
+                                   b"content-length: 1000\r\n\r\n")
+
+                    for _ in range(1000):
+                        client.sendall(b"x")
+                        time.sleep(0.1)
+            except socket.error:
+                pass
+
+        thread = threading.Thread(target=trickle)
+        thread.daemon = True
+        thread.start()
+
+        api = "http://127.0.0.1:%s" % server.getsockname()[1]
+        start = time.time()
+
+        try:
+            with pytest.raises(Timeout):
+                Pssst(*create_profile(), server=api, timeout=1)
+        finally:
+            server.close()
+
+        assert time.time() - start < 5
+
+
+class TestPssstProfiler:
+    """
+    Tests Pssst profiler with the test cases:
+
+    * Profiler hot spots
+    * Profiler threads
+    * Profiler sampling
+
+    Methods
+    -------
+    test_profiler_hotspots()
+        Tests if the hot spots are attributed to the Pssst methods.
+    test_profiler_threads()
+        Tests if the worker threads of a pool are profiled.
+    test_profiler_sampling()
+        Tests if only a sample of the calls is profiled.
+
+    """
+    def test_profiler_hotspots(self, tmpdir):
+        """
+        Tests if the hot spots are attributed to the Pssst methods.
+
+        """
+        username, password = create_profile()
+        profile = str(tmpdir.join("profile"))
+
+        pssst = Pssst(username, password)
+        pssst.create()
+
+        profiler = PssstProfiler()
+
+        with profiler:
+            pssst.push(username, "Hello World!")
+            pssst.pull()
+
+        profiler.dump(profile)
+
+        names = [name for name, _, _, _ in profiler.hotspots(100)]
+
+        assert "Pssst.__request_api" in names
+        assert "_Key.encrypt" in names
+        assert "_Key.decrypt" in names
+        assert os.path.exists(profile)
+
+    def test_profiler_threads(self):
+        """
+        Tests if the worker threads of a pool are profiled.
+
+        """
+        username, password = create_profile()
+
+        pool = PssstPool(workers=2)
+        pool.add(username, password).create()
+        pool.get(username).push(username, "Hello World!")
+
+        profiler = PssstProfiler()
+
+        with profiler:
+            assert pool.pull()[username] == [b"Hello World!"]
+
+        names = [name for name, _, _, _ in profiler.hotspots(100)]
+
+        assert "Pssst.__request_api" in names
+        assert "_Key.decrypt" in names
+
+    def test_profiler_sampling(self):
+        """
+        Tests if only a sample of the calls is profiled.
+
+        """
+        profiler = PssstProfiler(0.0)
+
+        for _ in range(10):
+            with profiler:
+                Pssst._User("pssst.name")
+
+        assert profiler.calls == 10
+        assert profiler.sampled == 0
+        assert profiler.hotspots() == []
+
+
+class TestCLIStream:
+    """
+    Tests CLI streams with the test cases:
+
+    * Stream lines
+    * Stream frames
+    * Stream truncated
+    * Stream unknown
+    * Stream failed
+
+    Methods
+    -------
+    test_stream_lines()
+        Tests if newline delimited messages are read and written.
+    test_stream_frames()
+        Tests if length prefixed messages are read and written.
+    test_stream_truncated()
+        Tests if a truncated stream is detected.
+    test_stream_unknown()
+        Tests if an unknown format is detected before pulling.
+    test_stream_failed()
+        Tests if messages are kept if they could not be written.
+
+    """
+    def test_stream_lines(self):
+        """
+        Tests if newline delimited messages are read and written.
+
+        """
+        messages = [b"Hello", b"", b"World!"]
+        stream = io.BytesIO()
+
+        for message in messages:
+            CLI.write(stream, message, "lines")
+
+        stream.seek(0)
+
+        assert list(CLI.read(stream, "lines")) == messages
+
+    def test_stream_frames(self):
+        """
+        Tests if length prefixed messages are read and written.
+
+        """
+        messages = [os.urandom(size) for size in (0, 1, 1024)] + [b"\n\n"]
+        stream = io.BytesIO()
+
+        for message in messages:
+            CLI.write(stream, message, "frames")
+
+        stream.seek(0)
+
+        assert list(CLI.read(stream, "frames")) == messages
+
+    def test_stream_truncated(self):
+        """
+        Tests if a truncated stream is detected.
+
+        """
+        stream = io.BytesIO()
+        CLI.write(stream, b"Hello World!", "frames")
+
+        with pytest.raises(Exception) as ex:
+            list(CLI.read(io.BytesIO(stream.getvalue()[:-1]), "frames"))
+
+        assert str(ex.value) == "Stream truncated"
+
+    def test_stream_unknown(self):
+        """
+        Tests if an unknown format is detected before pulling.
+
+        """
+        username, password = create_profile()
+        profile = "%s:%s" % (username, password)
+
+        pssst.main("pssst.py", "create", profile)
+        pssst.main("pssst.py", "push", profile, username, "Hello World!")
+
+        error = pssst.main("pssst.py", "dump", profile, "framez")
+
+        assert error == "Error: Stream format unknown"
+        assert CLI.account(profile)[1].pull() == [b"Hello World!"]
+
+    def test_stream_failed(self, monkeypatch):
+        """
+        Tests if messages are kept if they could not be written.
+
+        """
+        username, password = create_profile()
+        profile = "%s:%s" % (username, password)
+
+        pssst.main("pssst.py", "create", profile)
+        pssst.main("pssst.py", "push", profile, username, "Hello World!")
+
+        def write(stream, data, framing="lines"):
+            raise IOError("Broken pipe")
+
+        monkeypatch.setattr(CLI, "write", staticmethod(write))
+
+        error = pssst.main("pssst.py", "dump", profile)
+
+        assert error == "Error: Broken pipe"
+        assert CLI.account(profile)[1].pull() == [b"Hello World!"]
+
+
+class TestCLIBatch:
+    """
+    Tests CLI batches with the test cases:
+
+    * Batch commands
+    * Batch abort
+
+    Methods
+    -------
+    test_batch_commands()
+        Tests if all commands are run with one account per profile.
+    test_batch_abort()
+        Tests if an interrupt stops the whole batch.
+
+    """
+    def test_batch_commands(self, tmpdir, capsys, monkeypatch):
+        """
+        Tests if all commands are run with one account per profile.
+
+        """
+        username, password = create_profile()
+        profile = "%s:%s" % (username, password)
+        accounts, init = [], Pssst.__init__
+
+        def counted(self, *args, **kwargs):
+            accounts.append(self)
+            init(self, *args, **kwargs)
+
+        monkeypatch.setattr(Pssst, "__init__", counted)
+
+        batch = tmpdir.join("batch")
+        batch.write("\n".join([
+            "# Comment",
+            "create %s" % profile,
+            "push %s %s 'Hello World!'" % (profile, username),
+            "",
+            "pull %s" % profile,
+            "create %s" % profile
+        ]))
+
+        assert CLI.batch("pssst.py", str(batch)) == 1
+
+        out, err = capsys.readouterr()
+
+        assert "Hello World!\n" in out
+        assert "Line 6: create (Error: User already exists)" in err
+        assert "Batch: 4 commands, 1 failed" in err
+        assert accounts == [CLI.account(profile)[1]]
+
+    def test_batch_abort(self, tmpdir, capsys, monkeypatch):
+        """
+        Tests if an interrupt stops the whole batch.
+
+        """
+        commands = []
+
+        def main(script, *args):
+            commands.append(args)
+
+            return "Abort" if len(commands) == 2 else None
+
+        monkeypatch.setattr(pssst, "main", main)
+
+        batch = tmpdir.join("batch")
+        batch.write("\n".join(["--version"] * 4))
+
+        with pytest.raises(KeyboardInterrupt):
+            CLI.batch("pssst.py", str(batch))
+
+        out, err = capsys.readouterr()
+
+        assert len(commands) == 2
+        assert "Batch: 2 commands, 1 failed" in err
+
+
 class TestFuzzy:
     """
     Tests with fuzzy data.
@@ -20,9 +20,16 @@
  *
  * Start script. Available config values:
  *
- *   port  = pssst port
- *   redis = redis port/socket
- *   debug = debug level (0 to 3)
+ *   port      = pssst port
+ *   storage   = storage backend (redis or memory)
+ *   redis     = redis port/socket
+ *   users     = maximum users (memory only)
+ *   snapshot  = snapshot file (memory only)
+ *   debug     = debug level (0 to 3)
+ *   ttl       = message expiry in seconds (0 = never)
+ *   box       = maximum messages per box (0 = unlimited)
+ *   tombstone = deleted user expiry in seconds (0 = never)
+ *   metrics   = local metrics port (0 = off)
  *
  * @return {Number} exit code
  */
@@ -37,8 +44,13 @@ try {
     if (!fs.existsSync(CONFIG)) {
       fs.writeFileSync(CONFIG, JSON.stringify({
         "port": 62221,
+        "storage": "redis",
         "redis": 6379,
-        "debug": 0
+        "debug": 0,
+        "ttl": 0,
+        "box": 0,
+        "tombstone": 0,
+        "metrics": 0
       }, null, 2));
     }
 
@@ -48,7 +60,10 @@ try {
 
     // Start node cluster
     if (cluster.isMaster) {
-      if (process.env.DYNO) {
+      // In-memory storage is not shared
+      if (config.storage === 'memory') {
+        var cpus = 1;
+      } else if (process.env.DYNO) {
         var cpus = process.env.WEB_CONCURRENCY || 1;
       } else {
         var cpus = os.cpus().length;
@@ -62,6 +77,33 @@ try {
       cluster.on('exit', function exit() {
         cluster.fork();
       });
+
+      // Serve aggregated worker metrics
+      if (config.metrics > 0) {
+        var metrics = require('./server/metrics.js');
+
+        cluster.on('message', function message(worker, message) {
+          metrics.merge(message);
+        });
+
+        metrics.serve(config.metrics);
+      }
+
+      // Start background sweeper (in-memory storage sweeps itself)
+      var expiry = config.ttl > 0 || config.tombstone > 0;
+
+      if (expiry && config.storage !== 'memory') {
+        var storage = require('./server/storage.js');
+        var Sweeper = require('./server/sweeper.js');
+
+        storage(config, function ready(err, db) {
+          if (err) {
+            console.error(err.stack || err);
+          } else {
+            new Sweeper(config, db).start();
+          }
+        });
+      }
     } else {
       server(config, function ready(err, server) {
         if (err) {
@@ -0,0 +1,102 @@
+/**
+ * Copyright (C) 2013-2015  Christian & Christian <hello@pssst.name>
+ * Copyright (C) 2015-2017  Christian Uhsat <christian@uhsat.de>
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program. If not, see <http://www.gnu.org/licenses/>.
+ *
+ *
+ *
+ * Simple LRU cache, based on the insertion order of a Map.
+ *
+ * @param {Number} maximum number of entries
+ */
+module.exports = function Cache(size) {
+  var map = new Map();
+
+  /**
+   * Returns the value of a key and marks it as recently used.
+   *
+   * @param {String} the key
+   * @return {Object} the value or undefined
+   */
+  this.get = function get(key) {
+    if (!map.has(key)) {
+      return undefined;
+    }
+
+    var val = map.get(key);
+
+    map.delete(key);
+    map.set(key, val);
+
+    return val;
+  };
+
+  /**
+   * Returns the value of a key without marking it as recently used.
+   *
+   * @param {String} the key
+   * @return {Object} the value or undefined
+   */
+  this.peek = function peek(key) {
+    return map.get(key);
+  };
+
+  /**
+   * Sets the value of a key and evicts the least recently used key.
+   *
+   * @param {String} the key
+   * @param {Object} the value
+   * @return {Object} the value
+   */
+  this.set = function set(key, val) {
+    map.delete(key);
+    map.set(key, val);
+
+    if (map.size > size) {
+      map.delete(map.keys().next().value);
+    }
+
+    return val;
+  };
+
+  /**
+   * Removes a key.
+   *
+   * @param {String} the key
+   */
+  this.delete = function remove(key) {
+    map.delete(key);
+  };
+
+  /**
+   * Returns all keys (least recently used first).
+   *
+   * @return {Array} the keys
+   */
+  this.keys = function keys() {
+    return Array.from(map.keys());
+  };
+
+  /**
+   * Returns the number of keys.
+   *
+   * @return {Number} the size
+   */
+  this.size = function length() {
+    return map.size;
+  };
+
+  return this;
+}
@@ -23,9 +23,14 @@ module.exports = function Crypto() {
   var fs = require('fs');
   var rsa = require('node-rsa');
   var crypto = require('crypto');
+  var Cache = require('./cache.js');
 
   var GRACE = 5;
   var FORMAT = 'base64';
+  var KEYS = 1024;
+
+  var SIGNATURES = 256; // per second
+  var SIGNATURE_SIZE = 4096;
 
   var RSA_SIZE = 2048;
   var RSA_HASH = 'sha256';
@@ -55,6 +60,12 @@ module.exports = function Crypto() {
     throw new Error('Key has no public part');
   }
 
+  // Parsed user keys and their PEM (per worker)
+  var keys = new Cache(KEYS);
+
+  // Signatures of the current second (per worker)
+  var signatures = {timestamp: null, cache: new Map(), hits: 0, misses: 0};
+
   /**
    * Returns the current timestamp (EPOCH).
    *
@@ -75,7 +86,7 @@ module.exports = function Crypto() {
     var hmac, timestamp = timestamp || getTimestamp();
 
     hmac = crypto.createHmac(RSA_HASH, timestamp.toString());
-    hmac.update(data.toString());
+    hmac.update(Buffer.isBuffer(data) ? data : data.toString());
 
     return {
       timestamp: timestamp,
@@ -94,24 +105,111 @@ module.exports = function Crypto() {
       data = JSON.stringify(data);
     }
 
-    var hmac = createHMAC(data);
+    var timestamp = getTimestamp();
 
-    return {
+    // The HMAC key changes every second
+    if (signatures.timestamp !== timestamp) {
+      signatures.timestamp = timestamp;
+      signatures.cache.clear();
+    }
+
+    var cacheable = data.length <= SIGNATURE_SIZE;
+
+    if (cacheable && signatures.cache.has(data)) {
+      signatures.hits++;
+
+      return signatures.cache.get(data);
+    }
+
+    signatures.misses++;
+
+    var hmac = createHMAC(data, timestamp);
+    var signature = {
       timestamp: hmac.timestamp,
       signature: key.sign(hmac.signature, FORMAT, FORMAT)
     };
+
+    if (cacheable && signatures.cache.size < SIGNATURES) {
+      signatures.cache.set(data, signature);
+    }
+
+    return signature;
+  };
+
+  /**
+   * Returns the signature cache statistics.
+   *
+   * @return {Object} hits, misses and hit rate
+   */
+  this.stats = function stats() {
+    var total = signatures.hits + signatures.misses;
+
+    return {
+      hits: signatures.hits,
+      misses: signatures.misses,
+      rate: total ? signatures.hits / total : 0
+    };
+  };
+
+  /**
+   * Returns the cached key of an user.
+   *
+   * @param {String} hashed user name
+   * @return {Object} parsed public key or undefined
+   */
+  this.cached = function cached(hash) {
+    var entry = keys.get(hash);
+
+    return entry && entry.key;
+  };
+
+  /**
+   * Returns if the cached key of an user differs from the given key.
+   *
+   * @param {String} hashed user name
+   * @param {String} public key (PEM format)
+   * @return {Boolean} true if stale
+   */
+  this.stale = function stale(hash, pem) {
+    var entry = keys.peek(hash);
+
+    return Boolean(entry) && entry.pem !== pem;
+  };
+
+  /**
+   * Parses and caches the key of an user.
+   *
+   * @param {String} hashed user name
+   * @param {String} public key (PEM format)
+   * @return {Object} parsed public key (or the PEM if invalid)
+   */
+  this.remember = function remember(hash, pem) {
+    try {
+      return keys.set(hash, {pem: pem, key: new rsa(pem)}).key;
+    } catch (err) {
+      return pem; // OpenSSL error
+    }
+  };
+
+  /**
+   * Removes the cached key of an user.
+   *
+   * @param {String} hashed user name
+   */
+  this.forget = function forget(hash) {
+    keys.delete(hash);
   };
 
   /**
    * Returns if the data could be verified.
    *
-   * @param {Object} the data
+   * @param {Object} the data (raw buffer)
    * @param {Object} the data HMAC
-   * @param {String} public key (PEM format)
+   * @param {Object} public key (PEM format or parsed)
    * @return {Boolean} true if verified
    */
   this.verify = function verify(data, hmac, pem) {
-    if (data instanceof Object) {
+    if (data instanceof Object && !Buffer.isBuffer(data)) {
       data = JSON.stringify(data);
     }
 
@@ -126,7 +224,11 @@ module.exports = function Crypto() {
     var hmac = createHMAC(data, timestamp);
 
     try {
-      return new rsa(pem).verify(hmac.signature, signature, FORMAT, FORMAT);
+      if (!(pem instanceof rsa)) {
+        pem = new rsa(pem);
+      }
+
+      return pem.verify(hmac.signature, signature, FORMAT, FORMAT);
     } catch (err) {
       return false; // OpenSSL error
     }
@@ -49,7 +49,7 @@ module.exports = function debug(level, req, res, next) {
   }
 
   if (level > 2) {
-    console.info(time, req.body);
+    console.info(time, Buffer.isBuffer(req.body) ? req.body.toString() : '');
   }
 
   // Monkey patching
@@ -30,9 +30,11 @@ module.exports = function Server(config, callback) {
 
   var info = require('../package.json');
   var debug = require('./debug.js');
-  var redis = require('./redis.js');
+  var storage = require('./storage.js');
+  var Sweeper = require('./sweeper.js');
   var pssst = require('./pssst.js');
   var crypto = require('./crypto.js');
+  var metrics = require('./metrics.js');
 
   var HEADER = 'x-pssst-hash';
 
@@ -72,9 +74,28 @@ module.exports = function Server(config, callback) {
    * @param {Object} next handler
    */
   function auth(db, req, res, next) {
-    if (JSON.stringify(req.body) === '{}') {
-      req.body = '';
-    }
+    var body;
+
+    // Raw request body (as signed by the client)
+    req.raw = Buffer.isBuffer(req.body) ? req.body : Buffer.alloc(0);
+    req.body = undefined;
+
+    /**
+     * Returns the parsed request body (parsed once on demand).
+     *
+     * @return {Object} the parsed body or null if invalid
+     */
+    req.json = function json() {
+      if (body === undefined) {
+        try {
+          body = JSON.parse(req.raw.toString() || 'null');
+        } catch (err) {
+          body = null;
+        }
+      }
+
+      return body;
+    };
 
     /**
      * Verifies a HTTP(S) request.
@@ -83,34 +104,52 @@ module.exports = function Server(config, callback) {
      * @param {Function} callback
      */
     req.verify = function verify(hash, callback) {
+      var stop = metrics.time('auth');
+
+      function fail(status) {
+        stop();
+
+        return res.sign(status, 'Verification failed');
+      }
+
       function verify(key) {
         var header = req.headers[HEADER];
 
         // Assert a public key exists
         if (!key) {
-          return res.sign(404, 'Verification failed');
+          return fail(404);
         }
 
         // Assert the signature format is valid
         if (!new RegExp('^[0-9]+; ?[A-Za-z0-9\+/]+=*$').test(header)) {
-          return res.sign(400, 'Verification failed');
+          return fail(400);
         }
 
         // Assert the signature of the body is valid
-        if (!crypto.verify(req.body, parseHeader(header), key)) {
-          return res.sign(401, 'Verification failed');
+        if (!crypto.verify(req.raw, parseHeader(header), key)) {
+          return fail(401);
         }
 
+        stop();
         callback();
       }
 
-      // Load public key from database if not given
+      // Load public key from cache or database if not given
       if (hash.indexOf('PUBLIC KEY') < 0) {
+        var key = crypto.cached(hash);
+
+        if (key) {
+          return verify(key);
+        }
+
         db.get(hash, function get(err, val) {
-          if (!err) {
-            verify(val ? val.key : null);
-          } else {
+          if (err) {
+            stop();
             res.error(err);
+          } else if (val && val.key) {
+            verify(crypto.remember(hash, val.key));
+          } else {
+            verify(null);
           }
         });
       } else {
@@ -128,7 +167,12 @@ module.exports = function Server(config, callback) {
     res.sign = function sign(status, body) {
       body = body || '';
 
-      res.setHeader(HEADER, buildHeader(crypto.sign(body)));
+      var stop = metrics.time('crypto.sign');
+      var signature = crypto.sign(body);
+
+      stop();
+
+      res.setHeader(HEADER, buildHeader(signature));
       res.status(status).send(body);
 
       return true;
@@ -157,9 +201,20 @@ module.exports = function Server(config, callback) {
   app = express();
   app.set('json spaces', 0);
 
-  redis(config.redis, function redis(err, db) {
+  storage(config, function storage(err, db) {
     if (!err) {
-      app.use(parser.json({limit: '1MB'}));
+      app.use(parser.raw({type: function all() {
+        return true;
+      }, limit: '1MB'}));
+
+      // Metrics hook
+      if (config.metrics > 0) {
+        metrics.enable();
+        metrics.instrument(db, 'db', ['get', 'set', 'push', 'pull', 'page']);
+        metrics.report();
+
+        app.use(metrics.middleware);
+      }
 
       // Debug hook
       app.use(function hook(req, res, next) {
@@ -181,7 +236,7 @@ module.exports = function Server(config, callback) {
       });
 
       // Add routes
-      pssst(app, db);
+      pssst(app, db, config);
 
       // Return server public key
       app.get('/key', function key(req, res) {
@@ -198,6 +253,21 @@ module.exports = function Server(config, callback) {
         res.sign(404, 'Not found');
       });
 
+      // In-memory storage is swept by its own process
+      if (config.storage === 'memory') {
+        new Sweeper(config, db).start();
+      }
+
+      // Report signature cache
+      if (config.debug > 0) {
+        setInterval(function report() {
+          var stats = crypto.stats();
+
+          console.info('Signature cache hit rate %s% (%s hits, %s misses)',
+            (stats.rate * 100).toFixed(1), stats.hits, stats.misses);
+        }, 60 * 1000).unref();
+      }
+
       server = app.listen(port);
       server.on('error', function error(err) {
         if (err.code != 'EADDRINUSE') {
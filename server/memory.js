@@ -0,0 +1,390 @@
+/**
+ * Copyright (C) 2013-2015  Christian & Christian <hello@pssst.name>
+ * Copyright (C) 2015-2017  Christian Uhsat <christian@uhsat.de>
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program. If not, see <http://www.gnu.org/licenses/>.
+ *
+ *
+ *
+ * Simple in-memory storage, implementing the same interface as the Redis
+ * wrapper. Intended for single node deployments and tests, as the data is
+ * only visible to a single process.
+ *
+ * The least recently used users (including their box) are evicted if the
+ * maximum number of users is exceeded. All data can optionally be written
+ * to a snapshot file periodically, which is loaded again on start.
+ *
+ * @param {Object} source (users and snapshot)
+ * @param {Function} callback
+ */
+module.exports = function Memory(source, callback) {
+  var fs = require('fs');
+  var Cache = require('./cache.js');
+
+  var USERS = 100000;   // maximum users
+  var INTERVAL = 60000; // ms between snapshots
+
+  var entries = new Cache(Number(source.users) || USERS);
+  var file = source.snapshot, dirty = false;
+
+  /**
+   * Returns the current timestamp (EPOCH).
+   *
+   * @return {Number} the timestamp
+   */
+  function getTimestamp() {
+    return Math.floor(Date.now() / 1000);
+  }
+
+  /**
+   * Returns the entry of a key (or undefined if expired).
+   *
+   * @param {String} the key
+   * @param {Boolean} create the entry if not existing
+   * @return {Object} the entry
+   */
+  function getEntry(key, create) {
+    var entry = entries.get(key);
+
+    if (entry && entry.expires && entry.expires <= getTimestamp()) {
+      entries.delete(key);
+      entry = undefined;
+    }
+
+    if (!entry && create) {
+      entry = entries.set(key, {
+        val: null, expires: 0, box: [], size: 0, seq: 0
+      });
+    }
+
+    return entry;
+  }
+
+  /**
+   * Returns the parsed message prefix (timestamp and sequence number).
+   *
+   * @param {String} the stored message
+   * @return {Object} timestamp, sequence number and data
+   */
+  function parseMessage(msg) {
+    var match = /^(\d+) (?:(\d+) )?([\s\S]*)$/.exec(msg);
+
+    return {
+      time: Number(match[1]),
+      seq: Number(match[2] || 0),
+      data: match[3]
+    };
+  }
+
+  /**
+   * Numbers all messages of the box in order, if the head of the box was
+   * stored without a sequence number (unnumbered messages are always older
+   * than numbered ones, but may already be followed by them).
+   *
+   * @param {Object} the entry
+   */
+  function numberBox(entry) {
+    if (!entry.box.length || parseMessage(entry.box[0]).seq) {
+      return;
+    }
+
+    entry.box = entry.box.map(function each(msg, i) {
+      msg = parseMessage(msg);
+
+      return msg.time + ' ' + (i + 1) + ' ' + msg.data;
+    });
+
+    entry.size = entry.box.join('').length;
+    entry.seq = entry.box.length;
+    dirty = true;
+  }
+
+  /**
+   * Calls back asynchronously (as with every other storage).
+   *
+   * @param {Function} callback
+   * @param {Array} callback arguments
+   */
+  function defer(callback, args) {
+    setImmediate(function defer() {
+      callback.apply(null, args);
+    });
+  }
+
+  /**
+   * Writes all entries to the snapshot file (if dirty).
+   *
+   * @param {Function} callback
+   */
+  function save(callback) {
+    if (!file || !dirty) {
+      return callback && callback(null);
+    }
+
+    var data = {};
+
+    entries.keys().forEach(function each(key) {
+      data[key] = entries.peek(key);
+    });
+
+    dirty = false;
+
+    // Write atomically
+    fs.writeFile(file + '.tmp', JSON.stringify(data), function write(err) {
+      if (err) {
+        return callback ? callback(err) : console.error(err.stack || err);
+      }
+
+      fs.rename(file + '.tmp', file, function rename(err) {
+        if (err && !callback) {
+          console.error(err.stack || err);
+        }
+
+        return callback && callback(err);
+      });
+    });
+  }
+
+  // Load snapshot
+  if (file && fs.existsSync(file)) {
+    try {
+      var data = JSON.parse(fs.readFileSync(file));
+
+      Object.keys(data).forEach(function each(key) {
+        entries.set(key, data[key]);
+      });
+    } catch (err) {
+      return callback(err);
+    }
+  }
+
+  if (file) {
+    setInterval(save, INTERVAL).unref();
+  }
+
+  return setImmediate(callback, null, {
+    /**
+     * Gets the user record of a key.
+     *
+     * @param {String} the key
+     * @param {Function} callback
+     */
+    get: function get(key, callback) {
+      var entry = getEntry(key);
+
+      defer(callback, [null, entry ? JSON.parse(entry.val) : null]);
+    },
+
+    /**
+     * Sets the user record of a key.
+     *
+     * @param {String} the key
+     * @param {Object} the value
+     * @param {Number} seconds to expire (optional)
+     * @param {Function} callback
+     */
+    set: function set(key, val, ttl, callback) {
+      var entry = getEntry(key, true);
+
+      if (typeof ttl === 'function') {
+        callback = ttl;
+        ttl = 0;
+      }
+
+      entry.val = JSON.stringify(val, null, 0);
+      entry.expires = ttl > 0 ? getTimestamp() + ttl : 0;
+      dirty = true;
+
+      defer(callback, [null]);
+    },
+
+    /**
+     * Appends a message to the box.
+     *
+     * @param {String} the key
+     * @param {String} the message (JSON)
+     * @param {Object} the box limits (size, count and ttl)
+     * @param {Function} callback
+     */
+    push: function push(key, msg, limits, callback) {
+      var entry = getEntry(key, true);
+
+      numberBox(entry);
+
+      if (entry.size >= limits.size) {
+        return defer(callback, [null, false]);
+      }
+
+      if (limits.count > 0 && entry.box.length >= limits.count) {
+        return defer(callback, [null, false]);
+      }
+
+      entry.seq = (entry.seq || 0) + 1;
+      msg = getTimestamp() + ' ' + entry.seq + ' ' + msg;
+
+      entry.box.push(msg);
+      entry.size += msg.length;
+      dirty = true;
+
+      defer(callback, [null, true]);
+    },
+
+    /**
+     * Removes and returns all messages of the box (expired are dropped).
+     *
+     * @param {String} the key
+     * @param {Number} message ttl (optional)
+     * @param {Function} callback
+     */
+    pull: function pull(key, ttl, callback) {
+      var entry = getEntry(key), now = getTimestamp(), box = [];
+
+      if (entry) {
+        entry.box.forEach(function each(msg) {
+          msg = parseMessage(msg);
+
+          if (!(ttl > 0) || msg.time + ttl > now) {
+            box.push(msg.data);
+          }
+        });
+
+        entry.box = [];
+        entry.size = 0;
+        dirty = true;
+      }
+
+      defer(callback, [null, box]);
+    },
+
+    /**
+     * Removes the acknowledged messages (all up to the cursor) and returns
+     * the next page of messages.
+     *
+     * @param {String} the key
+     * @param {Number} the cursor (last acknowledged sequence number)
+     * @param {Number} the page size
+     * @param {Number} message ttl (optional)
+     * @param {Function} callback
+     */
+    page: function page(key, cursor, limit, ttl, callback) {
+      var entry = getEntry(key), now = getTimestamp(), box = [];
+
+      if (!entry) {
+        return defer(callback, [null, {cursor: cursor, more: false, box: box}]);
+      }
+
+      numberBox(entry);
+
+      while (entry.box.length) {
+        var seq = parseMessage(entry.box[0]).seq;
+
+        if (!seq || seq > cursor) {
+          break;
+        }
+
+        entry.size -= entry.box.shift().length;
+        dirty = true;
+      }
+
+      entry.box.slice(0, limit).forEach(function each(msg) {
+        msg = parseMessage(msg);
+        cursor = msg.seq;
+
+        if (!(ttl > 0) || msg.time + ttl > now) {
+          box.push(msg.data);
+        }
+      });
+
+      defer(callback, [null, {
+        cursor: cursor,
+        more: entry.box.length > limit,
+        box: box
+      }]);
+    },
+
+    /**
+     * Removes the box.
+     *
+     * @param {String} the key
+     * @param {Function} callback
+     */
+    clear: function clear(key, callback) {
+      var entry = getEntry(key);
+
+      if (entry) {
+        entry.box = [];
+        entry.size = 0;
+        dirty = true;
+      }
+
+      defer(callback, [null]);
+    },
+
+    /**
+     * Sweeps one batch of keys.
+     *
+     * Trims expired messages and sets the expiry of deleted users, which
+     * were deleted before an expiry was configured.
+     *
+     * @param {String} the cursor
+     * @param {Object} the options (count, ttl and tombstone)
+     * @param {Function} callback
+     */
+    sweep: function sweep(cursor, options, callback) {
+      var keys = entries.keys(), start = Number(cursor) || 0;
+      var end = start + options.count, now = getTimestamp(), freed = 0;
+
+      keys.slice(start, end).forEach(function each(key) {
+        var entry = entries.peek(key);
+
+        // Remove expired users
+        if (entry.expires && entry.expires <= now) {
+          freed += entry.size + (entry.val || '').length;
+          return entries.delete(key);
+        }
+
+        // Trim expired messages
+        while (options.ttl > 0 && entry.box.length) {
+          var msg = entry.box[0];
+
+          if (parseInt(msg, 10) + options.ttl > now) {
+            break;
+          }
+
+          entry.box.shift();
+          entry.size -= msg.length;
+          freed += msg.length;
+        }
+
+        // Expire deleted users
+        if (options.tombstone > 0 && !entry.expires &&
+            String(entry.val).indexOf('"key":null') >= 0) {
+          entry.expires = now + options.tombstone;
+          dirty = true;
+        }
+      });
+
+      dirty = dirty || freed > 0;
+
+      defer(callback, [null, end >= keys.length ? '0' : String(end), freed]);
+    },
+
+    /**
+     * Writes the snapshot file (if configured).
+     *
+     * @param {Function} callback
+     */
+    save: save
+  });
+}
@@ -0,0 +1,373 @@
+/**
+ * Copyright (C) 2013-2015  Christian & Christian <hello@pssst.name>
+ * Copyright (C) 2015-2017  Christian Uhsat <christian@uhsat.de>
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program. If not, see <http://www.gnu.org/licenses/>.
+ *
+ *
+ *
+ * Request metrics. Every worker records per-route counts, latency
+ * histograms and payload sizes, as well as the time spent in the phases of
+ * a request. The workers send their metrics periodically to the master,
+ * which aggregates them and serves them on a local HTTP endpoint:
+ *
+ *   GET http://127.0.0.1:<config.metrics>/
+ *
+ * Histograms use fixed buckets (upper bounds), so that they can be merged
+ * by simply adding the counts.
+ */
+module.exports = new function Metrics() {
+  var http = require('http');
+
+  var INTERVAL = 5000; // ms between reports
+
+  var LATENCY = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000];
+  var SIZE = [128, 512, 1024, 4096, 16384, 65536, 262144, 1048576];
+
+  var enabled = false, started = Date.now();
+
+  // Metrics recorded since the last report (worker) or overall (master)
+  var metrics = {routes: {}, phases: {}, workers: {}};
+
+  /**
+   * Returns a new histogram.
+   *
+   * @param {Array} bucket bounds
+   * @return {Object} the histogram
+   */
+  function createHistogram(bounds) {
+    return {
+      bounds: bounds,
+      counts: bounds.map(function zero() { return 0; }).concat(0),
+      count: 0,
+      sum: 0,
+      max: 0
+    };
+  }
+
+  /**
+   * Records a value in a histogram.
+   *
+   * @param {Object} the histogram
+   * @param {Number} the value
+   */
+  function record(histogram, value) {
+    var i = 0;
+
+    while (i < histogram.bounds.length && value > histogram.bounds[i]) {
+      i++;
+    }
+
+    histogram.counts[i]++;
+    histogram.count++;
+    histogram.sum += value;
+    histogram.max = Math.max(histogram.max, value);
+  }
+
+  /**
+   * Adds a histogram to another one.
+   *
+   * @param {Object} the target histogram
+   * @param {Object} the source histogram
+   */
+  function mergeHistogram(target, source) {
+    source.counts.forEach(function add(count, i) {
+      target.counts[i] += count;
+    });
+
+    target.count += source.count;
+    target.sum += source.sum;
+    target.max = Math.max(target.max, source.max);
+  }
+
+  /**
+   * Returns the approximated percentile of a histogram (bucket bound).
+   *
+   * @param {Object} the histogram
+   * @param {Number} the percentile (0 to 1)
+   * @return {Number} the upper bound or the maximum
+   */
+  function percentile(histogram, p) {
+    var rank = Math.ceil(histogram.count * p), seen = 0;
+
+    for (var i = 0; i < histogram.bounds.length; i++) {
+      if ((seen += histogram.counts[i]) >= rank) {
+        return Math.min(histogram.bounds[i], histogram.max);
+      }
+    }
+
+    return histogram.max;
+  }
+
+  /**
+   * Returns a histogram in readable form.
+   *
+   * @param {Object} the histogram
+   * @return {Object} summary and buckets
+   */
+  function summarize(histogram) {
+    var buckets = {};
+
+    histogram.bounds.forEach(function bucket(bound, i) {
+      buckets[bound] = histogram.counts[i];
+    });
+
+    buckets['+Inf'] = histogram.counts[histogram.bounds.length];
+
+    return {
+      count: histogram.count,
+      mean: histogram.count ? histogram.sum / histogram.count : 0,
+      p50: percentile(histogram, 0.5),
+      p90: percentile(histogram, 0.9),
+      p99: percentile(histogram, 0.99),
+      max: histogram.max,
+      buckets: buckets
+    };
+  }
+
+  /**
+   * Returns the metrics of a route.
+   *
+   * @param {String} the route
+   * @return {Object} the route metrics
+   */
+  function getRoute(route) {
+    if (!metrics.routes[route]) {
+      metrics.routes[route] = {
+        status: {},
+        latency: createHistogram(LATENCY),
+        request: createHistogram(SIZE),
+        response: createHistogram(SIZE)
+      };
+    }
+
+    return metrics.routes[route];
+  }
+
+  /**
+   * Returns the histogram of a phase.
+   *
+   * @param {String} the phase
+   * @return {Object} the histogram
+   */
+  function getPhase(phase) {
+    if (!metrics.phases[phase]) {
+      metrics.phases[phase] = createHistogram(LATENCY);
+    }
+
+    return metrics.phases[phase];
+  }
+
+  /**
+   * Returns the elapsed milliseconds since a high resolution time.
+   *
+   * @param {Array} the start time
+   * @return {Number} the milliseconds
+   */
+  function getElapsed(start) {
+    var time = process.hrtime(start);
+
+    return time[0] * 1e3 + time[1] / 1e6;
+  }
+
+  /**
+   * Enables the recording of metrics (in this process).
+   */
+  this.enable = function enable() {
+    enabled = true;
+  };
+
+  /**
+   * Starts a phase timer.
+   *
+   * @param {String} the phase
+   * @return {Function} stops the timer
+   */
+  this.time = function time(phase) {
+    if (!enabled) {
+      return function noop() {};
+    }
+
+    var start = process.hrtime();
+
+    return function stop() {
+      record(getPhase(phase), getElapsed(start));
+    };
+  };
+
+  /**
+   * Times all calls of the given asynchronous methods (callback last).
+   *
+   * @param {Object} the object
+   * @param {String} the phase prefix
+   * @param {Array} the method names
+   * @return {Object} the object
+   */
+  this.instrument = function instrument(object, prefix, names) {
+    var self = this;
+
+    names.forEach(function wrap(name) {
+      var method = object[name];
+
+      object[name] = function timed() {
+        var args = Array.prototype.slice.call(arguments);
+        var callback = args.pop();
+        var stop = self.time(prefix + '.' + name);
+
+        args.push(function done() {
+          stop();
+          callback.apply(this, arguments);
+        });
+
+        return method.apply(object, args);
+      };
+    });
+
+    return object;
+  };
+
+  /**
+   * Express middleware, records the route metrics of a request.
+   *
+   * @param {Object} request
+   * @param {Object} response
+   * @param {Object} next handler
+   */
+  this.middleware = function middleware(req, res, next) {
+    if (!enabled) {
+      return next();
+    }
+
+    var start = process.hrtime();
+
+    // Monkey patching
+    var end = res.end;
+    res.end = function patch(chunk, encoding) {
+      var path = req.route ? req.route.path : '*';
+      var route = getRoute(req.method + ' ' + path);
+      var status = String(res.statusCode).charAt(0) + 'xx';
+
+      route.status[status] = (route.status[status] || 0) + 1;
+
+      record(route.latency, getElapsed(start));
+      record(route.request, req.raw ? req.raw.length : 0);
+      record(route.response, chunk ? Buffer.byteLength(chunk, encoding) : 0);
+
+      metrics.workers[process.pid] = (metrics.workers[process.pid] || 0) + 1;
+
+      res.end = end;
+      res.end(chunk, encoding);
+    };
+
+    next();
+  };
+
+  /**
+   * Sends the recorded metrics to the master periodically (worker only).
+   */
+  this.report = function report() {
+    if (!enabled || !process.send) {
+      return;
+    }
+
+    setInterval(function report() {
+      process.send({metrics: metrics});
+
+      metrics = {routes: {}, phases: {}, workers: {}};
+    }, INTERVAL).unref();
+  };
+
+  /**
+   * Adds the metrics reported by a worker (master only).
+   *
+   * @param {Object} the message
+   */
+  this.merge = function merge(message) {
+    if (!message || !message.metrics) {
+      return;
+    }
+
+    var source = message.metrics;
+
+    Object.keys(source.routes).forEach(function route(name) {
+      var target = getRoute(name), route = source.routes[name];
+
+      Object.keys(route.status).forEach(function status(status) {
+        target.status[status] = (target.status[status] || 0) +
+          route.status[status];
+      });
+
+      mergeHistogram(target.latency, route.latency);
+      mergeHistogram(target.request, route.request);
+      mergeHistogram(target.response, route.response);
+    });
+
+    Object.keys(source.phases).forEach(function phase(name) {
+      mergeHistogram(getPhase(name), source.phases[name]);
+    });
+
+    Object.keys(source.workers).forEach(function worker(pid) {
+      metrics.workers[pid] = (metrics.workers[pid] || 0) + source.workers[pid];
+    });
+  };
+
+  /**
+   * Returns a readable snapshot of the recorded metrics.
+   *
+   * @return {Object} the snapshot
+   */
+  this.snapshot = function snapshot() {
+    var uptime = (Date.now() - started) / 1000, routes = {}, phases = {};
+
+    Object.keys(metrics.routes).forEach(function route(name) {
+      var route = metrics.routes[name];
+
+      routes[name] = {
+        rate: route.latency.count / uptime,
+        status: route.status,
+        latency: summarize(route.latency),
+        request: summarize(route.request),
+        response: summarize(route.response)
+      };
+    });
+
+    Object.keys(metrics.phases).forEach(function phase(name) {
+      phases[name] = summarize(metrics.phases[name]);
+    });
+
+    return {
+      uptime: uptime,
+      workers: metrics.workers,
+      routes: routes,
+      phases: phases
+    };
+  };
+
+  /**
+   * Serves the metrics on a local endpoint (master only).
+   *
+   * @param {Number} the port
+   * @return {Object} the HTTP server
+   */
+  this.serve = function serve(port) {
+    var self = this;
+
+    return http.createServer(function metrics(req, res) {
+      res.setHeader('content-type', 'application/json');
+      res.end(JSON.stringify(self.snapshot(), null, 2));
+    }).listen(port, '127.0.0.1');
+  };
+
+  return this;
+}
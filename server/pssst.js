@@ -21,9 +21,18 @@
  *
  * @param {Object} express app
  * @param {Object} database wrapper
+ * @param {Object} config object
  */
-module.exports = function Pssst(app, db) {
+module.exports = function Pssst(app, db, config) {
+  var crypto = require('./crypto.js');
+
   var LIMIT = 1024 * 1024; // 1 MB
+  var PAGE = 1000;          // messages
+
+  // Box limits (disabled if not configured)
+  var TTL = Number(config.ttl) || 0;
+  var BOX = Number(config.box) || 0;
+  var TOMBSTONE = Number(config.tombstone) || 0;
 
   /**
    * Pssst API (version 2).
@@ -68,6 +77,13 @@ module.exports = function Pssst(app, db) {
             return res.sign(410, 'User was deleted');
           }
 
+          // Verify again if the user was recreated since the key was cached
+          if (user !== null && crypto.stale(req.params.hash, user.key)) {
+            crypto.forget(req.params.hash);
+
+            return api.request(req, res, callback, auth);
+          }
+
           callback(user);
         });
       });
@@ -80,9 +96,10 @@ module.exports = function Pssst(app, db) {
      * @param {Object} response
      * @param {Object} user
      * @param {String} response body
+     * @param {Number} seconds to expire (optional)
      */
-    respond: function respond(req, res, user, body) {
-      db.set(req.params.hash, user, function set(err) {
+    respond: function respond(req, res, user, body, ttl) {
+      db.set(req.params.hash, user, ttl || 0, function set(err) {
         if (err) {
           return res.error(err);
         } else if (body) {
@@ -101,6 +118,8 @@ module.exports = function Pssst(app, db) {
    * @summary signed response
    */
   app.post('/2/:hash', function create(req, res) {
+    var key = (req.json() || {}).key;
+
     api.request(req, res, function request(user) {
 
       // Assert the user does not already exist
@@ -109,31 +128,39 @@ module.exports = function Pssst(app, db) {
       }
 
       // Assert the given key is a public key
-      if (req.body.key.indexOf('PUBLIC KEY') < 0) {
+      if (typeof key !== 'string' || key.indexOf('PUBLIC KEY') < 0) {
         return res.sign(400, 'User key invalid');
       }
 
       // User object
       user = {
-        key: req.body.key,
-        box: []
+        key: key
       };
 
       return api.respond(req, res, user, 'User created');
-    }, req.body.key);
+    }, key);
   });
 
   /**
-   * Deletes an existing user (disables only).
+   * Deletes an existing user (disables only). The disabled user will
+   * expire after the configured tombstone time.
    *
    * @summary signed request
    * @summary signed response
    */
   app.delete('/2/:hash', function disable(req, res) {
     api.request(req, res, function request(user) {
-      user.key = user.box = null;
+      user.key = null;
+
+      crypto.forget(req.params.hash);
+
+      db.clear(req.params.hash, function clear(err) {
+        if (err) {
+          return res.error(err);
+        }
 
-      return api.respond(req, res, user, 'User deleted');
+        return api.respond(req, res, user, 'User deleted', TOMBSTONE);
+      });
     });
   });
 
@@ -157,29 +184,89 @@ module.exports = function Pssst(app, db) {
    */
   app.put('/2/:hash/box', function push(req, res) {
     api.request(req, res, function request(user) {
+      var msg = req.json();
 
-      // Assert the user is within the limit
-      if (JSON.stringify(user).length >= LIMIT) {
-        return res.sign(413, 'User reached limit');
+      // Assert the message is an object
+      if (!msg || typeof msg !== 'object' || Array.isArray(msg)) {
+        return res.sign(400, 'Message invalid');
       }
 
-      user.box.push(req.body);
+      // Store the message as it was sent
+      msg = req.raw.toString();
+
+      // The key counts to the limit also
+      var limits = {
+        size: LIMIT - user.key.length,
+        count: BOX,
+        ttl: TTL
+      };
+
+      db.push(req.params.hash, msg, limits, function push(err, pushed) {
+        if (err) {
+          return res.error(err);
+        }
+
+        // Assert the user is within the limit
+        if (!pushed) {
+          return res.sign(413, 'User reached limit');
+        }
 
-      return api.respond(req, res, user, 'Message send');
+        return res.sign(200, 'Message send');
+      });
     }, false);
   });
 
   /**
-   * Pulls all messages from the box.
+   * Pulls messages from the box (expired messages are dropped).
+   *
+   * Without a query, all messages are removed and returned. With a limit
+   * and a cursor, all messages up to the cursor are acknowledged (removed)
+   * and the next page of messages is returned, together with the cursor to
+   * acknowledge it. A limit of 0 only acknowledges.
    *
    * @summary signed request
    * @summary signed response
    */
   app.get('/2/:hash/box', function pull(req, res) {
+    var paged = req.query.limit !== undefined || req.query.cursor !== undefined;
+    var limit = Number(req.query.limit === undefined ? 100 : req.query.limit);
+    var cursor = Number(req.query.cursor || 0);
+
+    // Assert the page is valid
+    if (paged && !(limit >= 0 && limit <= PAGE && limit % 1 === 0)) {
+      return res.sign(400, 'Limit invalid');
+    }
+
+    // Assert the cursor is valid
+    if (paged && !(cursor >= 0 && cursor % 1 === 0)) {
+      return res.sign(400, 'Cursor invalid');
+    }
+
     api.request(req, res, function request(user) {
-      var box = user.box.splice(0, user.box.length);
+      if (!paged) {
+        return db.pull(req.params.hash, TTL, function pull(err, box) {
+          if (err) {
+            return res.error(err);
+          }
 
-      return api.respond(req, res, user, box);
+          // Messages are already serialized
+          res.type('json');
+
+          return res.sign(200, '[' + box.join(',') + ']');
+        });
+      }
+
+      db.page(req.params.hash, cursor, limit, TTL, function page(err, page) {
+        if (err) {
+          return res.error(err);
+        }
+
+        // Messages are already serialized
+        res.type('json');
+
+        return res.sign(200, '{"cursor":' + page.cursor + ',"more":' +
+          page.more + ',"box":[' + page.box.join(',') + ']}');
+      });
     });
   });
 
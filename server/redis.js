@@ -19,13 +19,255 @@
  *
  * Simple Redis wrapper with Heroku support.
  *
+ * Every user is stored as a small JSON record holding only the key. Its box
+ * is stored as Redis list of JSON strings (<hash>:box), together with a
+ * running byte counter (<hash>:size). Users stored in the old layout (one
+ * JSON record including the whole box) are migrated on first access.
+ *
+ * Every message is prefixed with its push timestamp (EPOCH) and its sequence
+ * number (<hash>:seq), so expired messages can be trimmed from the head of
+ * the box and acknowledged messages can be removed by a cursor. Messages
+ * stored before are numbered in box order by the next push or page read,
+ * all at once, so the sequence numbers always ascend along the box.
+ *
+ * All Lua scripts are loaded once and called by their SHA1 digest.
+ *
  * @param {Object} source
  * @param {Function} callback
  */
 module.exports = function Redis(source, callback) {
   var url = require('url');
+  var crypto = require('crypto');
   var redis = require('redis');
 
+  var SWEEP = 1000; // messages per box and step
+
+  /**
+   * Migrates an old user record and returns the new record.
+   *
+   * KEYS = record, box, size
+   * ARGV = now
+   */
+  var MIGRATE = [
+    'local val = redis.call("GET", KEYS[1])',
+    'if not val or not string.find(val, \'"box":[\', 1, true) then',
+    '  return val',
+    'end',
+    'local user = cjson.decode(val)',
+    'for _, msg in ipairs(user.box) do',
+    '  msg = ARGV[1] .. " " .. cjson.encode(msg)',
+    '  redis.call("RPUSH", KEYS[2], msg)',
+    '  redis.call("INCRBY", KEYS[3], #msg)',
+    'end',
+    'user.box = nil',
+    'val = cjson.encode(user)',
+    'redis.call("SET", KEYS[1], val)',
+    'return val'
+  ].join('\n');
+
+  /**
+   * Numbers all messages of the box in order, if the head of the box was
+   * stored without a sequence number (unnumbered messages are always older
+   * than numbered ones, but may already be followed by them).
+   *
+   * box, size, seq = keys
+   * now = timestamp for unstamped messages
+   */
+  var NUMBER = [
+    'local function number(box, size, seq, now)',
+    '  local head = redis.call("LINDEX", box, 0)',
+    '  if not head or string.match(head, "^%d+ %d+ ") then',
+    '    return',
+    '  end',
+    '  local msgs, delta = redis.call("LRANGE", box, 0, -1), 0',
+    '  for i, msg in ipairs(msgs) do',
+    '    local time, data = string.match(msg, "^(%d+) %d+ (.*)$")',
+    '    if not time then',
+    '      time, data = string.match(msg, "^(%d+) (.*)$")',
+    '    end',
+    '    if not time then',
+    '      time, data = now, msg',
+    '    end',
+    '    local val = time .. " " .. i .. " " .. data',
+    '    redis.call("LSET", box, i - 1, val)',
+    '    delta = delta + #val - #msg',
+    '  end',
+    '  redis.call("INCRBY", size, delta)',
+    '  redis.call("SET", seq, #msgs)',
+    'end'
+  ];
+
+  /**
+   * Pushes a message if the box is within the limits.
+   *
+   * KEYS = box, size, seq
+   * ARGV = message, now, size limit, count limit, ttl
+   */
+  var PUSH = NUMBER.concat([
+    'number(KEYS[1], KEYS[2], KEYS[3], ARGV[2])',
+    'local size = tonumber(redis.call("GET", KEYS[2]) or "0")',
+    'if size >= tonumber(ARGV[3]) then',
+    '  return 0',
+    'end',
+    'local count = tonumber(ARGV[4])',
+    'if count > 0 and redis.call("LLEN", KEYS[1]) >= count then',
+    '  return 0',
+    'end',
+    'local seq = redis.call("INCR", KEYS[3])',
+    'local msg = ARGV[2] .. " " .. seq .. " " .. ARGV[1]',
+    'redis.call("RPUSH", KEYS[1], msg)',
+    'redis.call("INCRBY", KEYS[2], #msg)',
+    'local ttl = tonumber(ARGV[5])',
+    'if ttl > 0 then',
+    '  redis.call("EXPIRE", KEYS[1], ttl)',
+    '  redis.call("EXPIRE", KEYS[2], ttl)',
+    'end',
+    'return 1'
+  ]).join('\n');
+
+  /**
+   * Drains the box and returns all messages not expired.
+   *
+   * KEYS = box, size
+   * ARGV = now, ttl
+   */
+  var PULL = [
+    'local now, ttl = tonumber(ARGV[1]), tonumber(ARGV[2])',
+    'local box = redis.call("LRANGE", KEYS[1], 0, -1)',
+    'local res = {}',
+    'redis.call("DEL", KEYS[1], KEYS[2])',
+    'for _, msg in ipairs(box) do',
+    '  local time, seq, data = string.match(msg, "^(%d+) (%d+) (.*)$")',
+    '  if not time then',
+    '    time, data = string.match(msg, "^(%d+) (.*)$")',
+    '  end',
+    '  if not time then',
+    '    time, data = now, msg',
+    '  end',
+    '  if ttl <= 0 or tonumber(time) + ttl > now then',
+    '    table.insert(res, data)',
+    '  end',
+    'end',
+    'return res'
+  ].join('\n');
+
+  /**
+   * Removes all acknowledged messages and returns the next page.
+   *
+   * KEYS = box, size, seq
+   * ARGV = cursor, limit, now, ttl
+   */
+  var PAGE = NUMBER.concat([
+    'number(KEYS[1], KEYS[2], KEYS[3], ARGV[3])',
+    'local cursor, limit = tonumber(ARGV[1]), tonumber(ARGV[2])',
+    'local now, ttl = tonumber(ARGV[3]), tonumber(ARGV[4])',
+    'while true do',
+    '  local msg = redis.call("LINDEX", KEYS[1], 0)',
+    '  local seq = msg and tonumber(string.match(msg, "^%d+ (%d+) "))',
+    '  if not seq or seq > cursor then',
+    '    break',
+    '  end',
+    '  redis.call("LPOP", KEYS[1])',
+    '  redis.call("DECRBY", KEYS[2], #msg)',
+    'end',
+    'local box = {}',
+    'if limit > 0 then',
+    '  box = redis.call("LRANGE", KEYS[1], 0, limit - 1)',
+    'end',
+    'local res = {}',
+    'for _, msg in ipairs(box) do',
+    '  local time, seq, data = string.match(msg, "^(%d+) (%d+) (.*)$")',
+    '  cursor = tonumber(seq)',
+    '  if ttl <= 0 or tonumber(time) + ttl > now then',
+    '    table.insert(res, data)',
+    '  end',
+    'end',
+    'local more = redis.call("LLEN", KEYS[1]) > #box and 1 or 0',
+    'return {cursor, more, res}'
+  ]).join('\n');
+
+  /**
+   * Trims expired messages from the head of the box.
+   *
+   * KEYS = box, size
+   * ARGV = now, ttl, maximum
+   */
+  var TRIM = [
+    'local now, ttl = tonumber(ARGV[1]), tonumber(ARGV[2])',
+    'local freed = 0',
+    'for i = 1, tonumber(ARGV[3]) do',
+    '  local msg = redis.call("LINDEX", KEYS[1], 0)',
+    '  local time = msg and tonumber(string.match(msg, "^(%d+) "))',
+    '  if not time or time + ttl > now then',
+    '    break',
+    '  end',
+    '  redis.call("LPOP", KEYS[1])',
+    '  redis.call("DECRBY", KEYS[2], #msg)',
+    '  freed = freed + #msg',
+    'end',
+    'if redis.call("LLEN", KEYS[1]) == 0 then',
+    '  redis.call("DEL", KEYS[2])',
+    'end',
+    'return freed'
+  ].join('\n');
+
+  /**
+   * Sets the expiry of a deleted user record (if not already set).
+   *
+   * KEYS = record
+   * ARGV = ttl
+   */
+  var TOMBSTONE = [
+    'if redis.call("TTL", KEYS[1]) ~= -1 then',
+    '  return 0',
+    'end',
+    'local val = redis.call("GET", KEYS[1])',
+    'if not val or not string.find(val, \'"key":null\', 1, true) then',
+    '  return 0',
+    'end',
+    'redis.call("EXPIRE", KEYS[1], ARGV[1])',
+    'return 1'
+  ].join('\n');
+
+  var SCRIPTS = [MIGRATE, PUSH, PULL, PAGE, TRIM, TOMBSTONE];
+
+  // SHA1 digests of all scripts (as computed by Redis)
+  var hashes = {};
+
+  SCRIPTS.forEach(function each(script) {
+    hashes[script] = crypto.createHash('sha1').update(script).digest('hex');
+  });
+
+  /**
+   * Returns the current timestamp (EPOCH).
+   *
+   * @return {Number} the timestamp
+   */
+  function getTimestamp() {
+    return Math.floor(Date.now() / 1000);
+  }
+
+  /**
+   * Evaluates a cached script (Redis EVALSHA). Falls back to sending the
+   * whole script if it is not cached (Redis EVAL), which caches it again.
+   *
+   * @param {String} the script
+   * @param {...*} the number of keys, the keys and the arguments
+   * @param {Function} callback
+   */
+  function evaluate(script) {
+    var args = Array.prototype.slice.call(arguments, 1);
+    var callback = args.pop();
+
+    client.EVALSHA([hashes[script]].concat(args), function evalsha(err, res) {
+      if (err && /^NOSCRIPT/.test(err.message)) {
+        return client.EVAL([script].concat(args), callback);
+      }
+
+      callback(err, res);
+    });
+  }
+
   // Heroku support
   if (process.env.REDIS_URL) {
     var client = redis.createClient(process.env.REDIS_URL);
@@ -40,30 +282,166 @@ module.exports = function Redis(source, callback) {
 
   // Client ready
   client.on('ready', function ready(err) {
+    // Cache all scripts (again after a restart of Redis)
+    SCRIPTS.forEach(function each(script) {
+      client.SCRIPT('LOAD', script, function load(err) {
+        if (err) {
+          console.error(err.stack || err);
+        }
+      });
+    });
+
     return callback(err, {
       /**
-       * Gets the value of a key (Redis GET).
+       * Gets the user record of a key (Redis GET).
        *
        * @param {String} the key
        * @param {Function} callback
        */
       get: function get(key, callback) {
-        client.GET(key, function get(err, val) {
-          callback(err, JSON.parse(val));
-        });
+        evaluate(MIGRATE, 3, key, key + ':box', key + ':size',
+          getTimestamp(), function get(err, val) {
+            callback(err, JSON.parse(val));
+          }
+        );
       },
 
       /**
-       * Sets the value of a key (Redis SET).
+       * Sets the user record of a key (Redis SET).
        *
        * @param {String} the key
        * @param {Object} the value
+       * @param {Number} seconds to expire (optional)
        * @param {Function} callback
        */
-      set: function set(key, val, callback) {
-        client.SET(key, JSON.stringify(val, null, 0), function set(err) {
+      set: function set(key, val, ttl, callback) {
+        var args = [key, JSON.stringify(val, null, 0)];
+
+        if (typeof ttl === 'function') {
+          callback = ttl;
+        } else if (ttl > 0) {
+          args.push('EX', ttl);
+        }
+
+        client.SET(args, function set(err) {
           callback(err);
         });
+      },
+
+      /**
+       * Appends a message to the box (Redis RPUSH and INCRBY).
+       *
+       * @param {String} the key
+       * @param {String} the message (JSON)
+       * @param {Object} the box limits (size, count and ttl)
+       * @param {Function} callback
+       */
+      push: function push(key, msg, limits, callback) {
+        evaluate(PUSH, 3, key + ':box', key + ':size', key + ':seq', msg,
+          getTimestamp(), limits.size, limits.count || 0, limits.ttl || 0,
+          function push(err, res) {
+            callback(err, res === 1);
+          }
+        );
+      },
+
+      /**
+       * Removes and returns all messages of the box (Redis LRANGE and DEL).
+       *
+       * @param {String} the key
+       * @param {Number} message ttl (optional)
+       * @param {Function} callback
+       */
+      pull: function pull(key, ttl, callback) {
+        evaluate(PULL, 2, key + ':box', key + ':size', getTimestamp(),
+          ttl || 0, function pull(err, box) {
+            callback(err, box || []);
+          }
+        );
+      },
+
+      /**
+       * Removes the acknowledged messages (all up to the cursor) and returns
+       * the next page of messages.
+       *
+       * @param {String} the key
+       * @param {Number} the cursor (last acknowledged sequence number)
+       * @param {Number} the page size
+       * @param {Number} message ttl (optional)
+       * @param {Function} callback
+       */
+      page: function page(key, cursor, limit, ttl, callback) {
+        evaluate(PAGE, 3, key + ':box', key + ':size', key + ':seq',
+          cursor, limit, getTimestamp(), ttl || 0, function page(err, res) {
+            if (err) {
+              return callback(err);
+            }
+
+            callback(null, {
+              cursor: Number(res[0]),
+              more: res[1] === 1,
+              box: res[2]
+            });
+          }
+        );
+      },
+
+      /**
+       * Removes the box (Redis DEL).
+       *
+       * @param {String} the key
+       * @param {Function} callback
+       */
+      clear: function clear(key, callback) {
+        client.DEL(key + ':box', key + ':size', key + ':seq',
+          function clear(err) {
+            callback(err);
+          }
+        );
+      },
+
+      /**
+       * Sweeps one batch of keys (Redis SCAN).
+       *
+       * Trims expired messages and sets the expiry of deleted users, which
+       * were deleted before an expiry was configured.
+       *
+       * @param {String} the cursor
+       * @param {Object} the options (count, ttl and tombstone)
+       * @param {Function} callback
+       */
+      sweep: function sweep(cursor, options, callback) {
+        client.SCAN(cursor, 'COUNT', options.count, function scan(err, res) {
+          if (err) {
+            return callback(err);
+          }
+
+          var keys = res[1], pending = 1, reclaimed = 0, failed = null;
+
+          function done(err, freed) {
+            failed = failed || err;
+            reclaimed += Number(freed) || 0;
+
+            if (--pending === 0) {
+              callback(failed, res[0], reclaimed);
+            }
+          }
+
+          keys.forEach(function each(key) {
+            if (/:box$/.test(key) && options.ttl > 0) {
+              pending++;
+              evaluate(TRIM, 2, key, key.replace(/:box$/, ':size'),
+                getTimestamp(), options.ttl, SWEEP, done);
+            } else if (key.indexOf(':') < 0 && options.tombstone > 0) {
+              pending++;
+              evaluate(TOMBSTONE, 1, key, options.tombstone, function (err) {
+                done(err, 0);
+              });
+            }
+          });
+
+          done(null, 0);
+        });
       }
     });
   });
@@ -0,0 +1,49 @@
+/**
+ * Copyright (C) 2013-2015  Christian & Christian <hello@pssst.name>
+ * Copyright (C) 2015-2017  Christian Uhsat <christian@uhsat.de>
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program. If not, see <http://www.gnu.org/licenses/>.
+ *
+ *
+ *
+ * Storage backend factory. Available storages:
+ *
+ *   redis  = Redis wrapper (default)
+ *   memory = in-memory storage (single process only)
+ *
+ * Every storage calls back with a wrapper implementing this interface:
+ *
+ *   get(key, callback)                 = gets the user record
+ *   set(key, val, [ttl], callback)     = sets the user record
+ *   push(key, msg, limits, callback)   = appends a message to the box
+ *   pull(key, ttl, callback)           = removes and returns the box
+ *   page(key, cursor, limit, ttl, cb)  = acknowledges and returns a page
+ *   clear(key, callback)               = removes the box
+ *   sweep(cursor, options, callback)   = sweeps one batch of keys
+ *
+ * @param {Object} config object
+ * @param {Function} callback
+ */
+module.exports = function Storage(config, callback) {
+  switch (config.storage || 'redis') {
+    case 'redis':
+      return require('./redis.js')(config.redis, callback);
+
+    case 'memory':
+      return require('./memory.js')(config, callback);
+
+    default:
+      return callback(new Error('Storage unknown: ' + config.storage));
+  }
+}
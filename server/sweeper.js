@@ -0,0 +1,83 @@
+/**
+ * Copyright (C) 2013-2015  Christian & Christian <hello@pssst.name>
+ * Copyright (C) 2015-2017  Christian Uhsat <christian@uhsat.de>
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program. If not, see <http://www.gnu.org/licenses/>.
+ *
+ *
+ *
+ * Background sweeper. Reclaims the memory of expired messages and deleted
+ * users incrementally, one small batch of keys per step, so the workers
+ * are never blocked by a long running command.
+ *
+ * @param {Object} config object
+ * @param {Object} database wrapper
+ */
+module.exports = function Sweeper(config, db) {
+  var COUNT = 100;   // keys per step
+  var DELAY = 1000;  // ms between steps
+
+  var cursor = '0', reclaimed = 0, timer = null;
+
+  var options = {
+    count: COUNT,
+    ttl: Number(config.ttl) || 0,
+    tombstone: Number(config.tombstone) || 0
+  };
+
+  /**
+   * Sweeps the next batch of keys and schedules the next step.
+   */
+  function step() {
+    db.sweep(cursor, options, function sweep(err, next, freed) {
+      if (err) {
+        console.error(err.stack || err);
+      } else {
+        reclaimed += freed;
+
+        // Full scan cycle finished
+        if ((cursor = next) === '0') {
+          if (config.debug > 0) {
+            console.log('Sweeper reclaimed %d bytes', reclaimed);
+          }
+
+          reclaimed = 0;
+        }
+      }
+
+      timer = setTimeout(step, DELAY);
+      timer.unref();
+    });
+  }
+
+  /**
+   * Starts the sweeper.
+   */
+  this.start = function start() {
+    if (!timer && (options.ttl > 0 || options.tombstone > 0)) {
+      timer = setTimeout(step, DELAY);
+      timer.unref();
+    }
+  };
+
+  /**
+   * Stops the sweeper.
+   */
+  this.stop = function stop() {
+    clearTimeout(timer);
+    timer = null;
+  };
+
+  return this;
+}